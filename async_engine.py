@@ -0,0 +1,204 @@
+import time, asyncio, logging, threading, concurrent.futures
+import protocol
+from storage import FileRegion
+from config import max_uploads, listen_backlog
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPeerConnection(protocol.PeerProtocol):
+    """One peer connection driven by asyncio streams instead of threads.
+
+    Shares the message handling in protocol.PeerProtocol with PeerConnection,
+    so both engines speak exactly the same protocol to the same Node callbacks.
+    """
+
+    # Các message gọi vào Node (đọc/ghi đĩa, hash) chạy trên executor để không chặn event loop
+    BLOCKING_TYPES = ("REQUEST_PIECE", "PIECE_DATA", "REQUEST_BLOCK", "BLOCK_DATA")
+    # Số message tối đa lấy khỏi hàng đợi cho một lần đọc đĩa trên executor
+    SEND_BATCH = 16
+
+    def __init__(self, engine, node, peer_address, session=None, is_initiator=True):
+        self._init_protocol(node, peer_address, session, is_initiator)
+        self.engine = engine
+        self.loop = engine.loop
+        self.running = True
+        self.outgoing = None
+        self.writer = None
+
+    def queue_message(self, message_dict):
+        # Có thể được gọi từ thread của executor hoặc từ Node
+        self.loop.call_soon_threadsafe(self._enqueue, message_dict)
+
+    def _enqueue(self, message_dict):
+        if self.outgoing is not None:
+            self.outgoing.put_nowait(message_dict)
+            self.queue_depth.inc(role=self.role)
+
+    def _handle_message_type(self, message):
+        if message.get('type') in self.BLOCKING_TYPES:
+            self.loop.run_in_executor(self.engine.executor, super()._handle_message_type, message)
+        else:
+            super()._handle_message_type(message)
+
+    def _read_chunks(self, messages):
+        """Encode các message, đọc FileRegion thành bytes (chạy trên executor)"""
+        return [
+            [chunk.read() if isinstance(chunk, FileRegion) else chunk
+             for chunk in self._encode_message(message_dict)]
+            for message_dict in messages
+        ]
+
+    async def run(self, reader, writer):
+        self.writer = writer
+        self.outgoing = asyncio.Queue()
+        send_task = asyncio.create_task(self._send_loop(writer))
+        self.engine.connections.add(self)
+        try:
+            if self.is_initiator:
+                self._enqueue(self._hello_message())
+
+            while self.running:
+                data = await reader.read(self.RECV_SIZE)
+                if not data:
+                    break
+                self.buffer += data
+                self._drain_buffer()
+                delay = self._receive_delay(data)
+                if delay:
+                    await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning("%s: Connection error: %s", self.role, e)
+        finally:
+            self.running = False
+            send_task.cancel()
+            writer.close()
+            # Message chưa gửi sẽ không bao giờ được gửi nữa
+            self.queue_depth.dec(self.outgoing.qsize(), role=self.role)
+            self.outgoing = None
+            self.engine.connections.discard(self)
+            self.release_requests()
+            self.node.rate_limiter.forget_peer(self.peer_address)
+
+    async def _send_loop(self, writer):
+        try:
+            while True:
+                messages = [await self.outgoing.get()]
+                while len(messages) < self.SEND_BATCH and not self.outgoing.empty():
+                    messages.append(self.outgoing.get_nowait())
+                self.queue_depth.dec(len(messages), role=self.role)
+                messages = [m for m in messages if self._should_send(m)]
+                if any(isinstance(m.get('data'), FileRegion) for m in messages):
+                    # Đọc đĩa cả lô trên executor, không chặn event loop
+                    batches = await self.loop.run_in_executor(
+                        self.engine.executor, self._read_chunks, messages)
+                else:
+                    batches = [self._encode_message(m) for m in messages]
+                for message_dict, chunks in zip(messages, batches):
+                    self._log_message("Sending", message_dict)
+                    delay = self._send_delay(chunks)
+                    if delay:
+                        await asyncio.sleep(delay)
+                    start = time.perf_counter()
+                    writer.writelines(chunks)
+                    await writer.drain()
+                    self._message_sent(message_dict, time.perf_counter() - start)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning("Message sending error: %s", e)
+            self.cleanup()
+
+    def cleanup(self):
+        """Đóng kết nối, an toàn khi gọi từ thread bất kỳ"""
+        self.running = False
+        if self.writer:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class AsyncPeerEngine:
+    """Chạy toàn bộ kết nối peer của một node trên một event loop duy nhất"""
+
+    def __init__(self, node, max_uploads=max_uploads, backlog=listen_backlog, workers=4):
+        self.node = node
+        self.max_uploads = max_uploads
+        self.backlog = backlog
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.connections = set()
+        self.server = None
+        self.upload_slots = None
+        self.thread = threading.Thread(target=self._run_loop)
+        self.thread.daemon = True
+
+    def start(self):
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start_listening(self):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self._start_server(), self.loop)
+
+    async def _start_server(self):
+        if self.server:
+            return
+        self.upload_slots = asyncio.Semaphore(self.max_uploads)
+        self.server = await asyncio.start_server(
+            self._handle_incoming, '0.0.0.0', self.node.port,
+            backlog=self.backlog, reuse_address=True
+        )
+        logger.info("Seeder: Listening on port %s (asyncio, max %s uploads)", self.node.port, self.max_uploads)
+
+    async def _handle_incoming(self, reader, writer):
+        # Kết nối vượt quá max_uploads chờ đến khi có slot trống
+        async with self.upload_slots:
+            peer_address = writer.get_extra_info('peername')
+            logger.info("Seeder: Accepted connection from %s:%s", peer_address[0], peer_address[1])
+            conn = AsyncPeerConnection(self, self.node, peer_address, is_initiator=False)
+            await conn.run(reader, writer)
+
+    def connect(self, peer_address, session):
+        """Mở kết nối leecher tới peer, trả về AsyncPeerConnection ngay lập tức"""
+        self.start()
+        conn = AsyncPeerConnection(self, self.node, peer_address, session, is_initiator=True)
+        asyncio.run_coroutine_threadsafe(self._connect(conn), self.loop)
+        return conn
+
+    async def _connect(self, conn):
+        try:
+            logger.info("%s: Connecting to %s:%s", conn.role, conn.peer_address[0], conn.peer_address[1])
+            reader, writer = await asyncio.open_connection(*conn.peer_address)
+            logger.debug("%s: Connected successfully", conn.role)
+        except Exception as e:
+            conn.running = False
+            logger.warning("%s: Connection error: %s", conn.role, e)
+            conn.release_requests()
+            return
+        await conn.run(reader, writer)
+
+    def stop(self):
+        if not self.loop.is_running():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        try:
+            future.result(timeout=5)
+        except Exception as e:
+            logger.error("Lỗi khi dừng asyncio engine: %s", e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+    async def _shutdown(self):
+        if self.server:
+            self.server.close()
+        for conn in list(self.connections):
+            conn.cleanup()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,230 @@
+import os, sys, json, time, socket, shutil, hashlib, logging, argparse, platform, resource, tempfile
+import threading, subprocess, statistics
+from log import setup_logging
+from fake_tracker import FakeTracker
+
+logger = logging.getLogger(__name__)
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    """'512K', '16M', '1G' hoặc số byte"""
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _summary(values):
+    if not values:
+        return None
+    return {'mean': statistics.mean(values), 'min': min(values), 'max': max(values)}
+
+
+def share(node, path):
+    """Chia sẻ file trên node, chờ xong, trả về magnet link (None nếu lỗi)"""
+    done = threading.Event()
+    result = {}
+
+    def on_progress(current, total, magnet_link=None, torrent_path=None):
+        if torrent_path is not None or total == 0:
+            result['magnet_link'] = magnet_link
+            done.set()
+
+    node.share_file(path, on_progress)
+    done.wait()
+    return result.get('magnet_link')
+
+
+def run_scenario(file_size, piece_length, seeders, leechers, engine, timeout, workdir):
+    """Chạy một swarm trên loopback trong process hiện tại, trả về dict kết quả.
+
+    All nodes share the process, so CPU time covers seeders and leechers
+    together; the caller runs every scenario in a fresh process so that
+    peak RSS belongs to that scenario only.
+    """
+    from node import Node
+
+    tracker = FakeTracker().start()
+    nodes = []
+
+    def new_node(name):
+        node = Node(port=free_port(), data_dir=os.path.join(workdir, name), tracker=tracker.url,
+                    ip="127.0.0.1", peer_engine=engine)
+        node.piece_length = piece_length
+        nodes.append(node)
+        return node
+
+    try:
+        source = os.path.join(workdir, "source.bin")
+        with open(source, 'wb') as f:
+            for offset in range(0, file_size, 1024 * 1024):
+                f.write(os.urandom(min(1024 * 1024, file_size - offset)))
+        source_digest = file_digest(source)
+
+        # Mỗi seeder tự hash file gốc và đăng ký với tracker như một node thật
+        share_start = time.monotonic()
+        magnet_link = None
+        for i in range(seeders):
+            seeder = new_node(f"seeder{i}")
+            magnet_link = share(seeder, source)
+            if not magnet_link:
+                raise RuntimeError("Sharing the source file failed")
+            seeder.start_listening()
+        share_seconds = (time.monotonic() - share_start) / seeders
+
+        leecher_nodes = [new_node(f"leecher{i}") for i in range(leechers)]
+        cpu_start = _cpu_seconds()
+        start = time.monotonic()
+        sessions = []
+        for leecher in leecher_nodes:
+            peers_data = leecher.discovery.lookup(magnet_link)
+            if not peers_data:
+                raise RuntimeError("Tracker lookup failed")
+            sessions.append(leecher.start_download(magnet_link, peers_data))
+
+        # Lấy mẫu bitfield để đo thời gian đến piece đầu tiên
+        first_piece = [None] * len(sessions)
+        deadline = start + timeout
+        while time.monotonic() < deadline and not all(session.finished.is_set() for session in sessions):
+            for i, session in enumerate(sessions):
+                if first_piece[i] is None and session.bitfield.count():
+                    first_piece[i] = time.monotonic() - start
+            time.sleep(0.001)
+        completed = [session.finished.is_set() for session in sessions]
+        elapsed = time.monotonic() - start
+        cpu_seconds = _cpu_seconds() - cpu_start
+
+        complete_times, ok = [], all(completed)
+        for session in sessions:
+            if session.finished.is_set():
+                complete_times.append(session.finished_at - start)
+                ok = ok and file_digest(session.output_path) == source_digest
+
+        return {
+            'ok': ok,
+            'completed': sum(completed),
+            'share_seconds': share_seconds,
+            'time_to_first_piece': _summary([t for t in first_piece if t is not None]),
+            'time_to_complete': _summary(complete_times),
+            'throughput_mb_s': _summary([file_size / t / 1024 ** 2 for t in complete_times]),
+            'aggregate_mb_s': file_size * len(complete_times) / elapsed / 1024 ** 2,
+            'cpu_seconds': cpu_seconds,
+            'cpu_percent': 100 * cpu_seconds / elapsed,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'tracker_requests': tracker.requests
+        }
+    finally:
+        for node in nodes:
+            try:
+                node.stop()
+            except Exception as e:
+                logger.warning("Lỗi khi dừng node: %s", e)
+        tracker.stop()
+
+
+def run_isolated(params, keep):
+    """Chạy một kịch bản trong process riêng, trả về dict kết quả"""
+    command = [sys.executable, os.path.abspath(__file__), "--scenario", json.dumps(params)]
+    if keep:
+        command.append("--keep")
+    process = subprocess.run(command, capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    lines = process.stdout.strip().splitlines()
+    if process.returncode != 0 or not lines:
+        return dict(params, ok=False, error=process.stderr.strip().splitlines()[-20:])
+    return dict(params, **json.loads(lines[-1]))
+
+
+def scenario_main(params, keep):
+    setup_logging(level="WARNING")
+    workdir = tempfile.mkdtemp(prefix="p2p-bench-")
+    try:
+        result = run_scenario(workdir=workdir, **params)
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result), flush=True)
+    # Thread của các node là daemon, không chờ chúng kết thúc
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark truyền file: swarm N seeder / M leecher trên loopback với tracker giả"
+    )
+    parser.add_argument("--sizes", default="4M,64M", help="Kích thước file, phân tách bằng dấu phẩy")
+    parser.add_argument("--piece-lengths", default="256K,512K,1M")
+    parser.add_argument("--seeders", type=int, default=1)
+    parser.add_argument("--leechers", type=int, default=1)
+    parser.add_argument("--engines", default="threads", help="threads, asyncio hoặc cả hai")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300, help="Giây tối đa cho mỗi kịch bản")
+    parser.add_argument("--output", help="File JSON kết quả (mặc định in ra stdout)")
+    parser.add_argument("--keep", action="store_true", help="Giữ lại thư mục dữ liệu tạm")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        scenario_main(json.loads(args.scenario), args.keep)
+
+    results = []
+    for engine in args.engines.split(','):
+        for size in args.sizes.split(','):
+            for piece_length in args.piece_lengths.split(','):
+                for run in range(args.repeat):
+                    params = {
+                        'file_size': parse_size(size),
+                        'piece_length': parse_size(piece_length),
+                        'seeders': args.seeders,
+                        'leechers': args.leechers,
+                        'engine': engine,
+                        'timeout': args.timeout
+                    }
+                    result = run_isolated(params, args.keep)
+                    result['run'] = run
+                    results.append(result)
+                    complete = result.get('time_to_complete') or {}
+                    throughput = result.get('throughput_mb_s') or {}
+                    print(f"{engine} size={size} piece={piece_length} run={run}: ok={result['ok']} "
+                          f"complete={complete.get('max', float('nan')):.2f}s "
+                          f"throughput={throughput.get('mean', float('nan')):.1f} MB/s "
+                          f"cpu={result.get('cpu_seconds', float('nan')):.2f}s "
+                          f"rss={result.get('peak_rss_kb', 0) / 1024:.0f} MB", file=sys.stderr)
+
+    report = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os, logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+
+class Bitfield:
+    """Bitmap 1 bit/piece của một torrent, lưu ra đĩa để tiếp tục sau khi khởi động lại.
+
+    Bit i is set once piece i has been verified and written to the download
+    file. All completion and progress queries read the in-memory bytearray;
+    save() writes it atomically (temp file + rename) and is rate-limited so a
+    burst of pieces costs one small write per SAVE_INTERVAL.
+    """
+
+    SAVE_INTERVAL = 1.0  # Giây tối thiểu giữa hai lần ghi file
+
+    def __init__(self, piece_count, path=None, data=None):
+        self.piece_count = piece_count
+        self.path = path
+        self.bits = bytearray(data) if data is not None else bytearray((piece_count + 7) // 8)
+        self.lock = threading.Lock()
+        self._count = sum(bin(byte).count('1') for byte in self.bits)
+        self._last_save = 0
+
+    @classmethod
+    def load(cls, path, piece_count):
+        """Đọc bitfield đã lưu, trả về bitfield rỗng nếu file không có hoặc sai kích thước"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        if data is not None and len(data) != (piece_count + 7) // 8:
+            logger.warning("Bỏ qua bitfield không hợp lệ: %s", path)
+            data = None
+        return cls(piece_count, path, data)
+
+    def has(self, piece_index):
+        return bool(self.bits[piece_index >> 3] & (0x80 >> (piece_index & 7)))
+
+    def set(self, piece_index):
+        with self.lock:
+            if not self.has(piece_index):
+                self.bits[piece_index >> 3] |= 0x80 >> (piece_index & 7)
+                self._count += 1
+
+    def clear(self, piece_index):
+        with self.lock:
+            if self.has(piece_index):
+                self.bits[piece_index >> 3] &= ~(0x80 >> (piece_index & 7)) & 0xFF
+                self._count -= 1
+
+    def count(self):
+        return self._count
+
+    def is_complete(self):
+        return self._count == self.piece_count
+
+    def missing(self):
+        """Các piece chưa có, theo thứ tự index"""
+        return [i for i in range(self.piece_count) if not self.has(i)]
+
+    def save(self, force=False):
+        if not self.path:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self._last_save < self.SAVE_INTERVAL:
+                return
+            self._last_save = now
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(self.bits)
+            os.replace(tmp_path, self.path)
+
+    def delete(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,3 +1,59 @@
 tracker_host = "http://btl-mmt-tracker.onrender.com"  # Đảm bảo URL này chính xácc
 # tracker_host = "http://localhost:8081"
+node_port = 52229  # Cổng seeding mặc định của node
+node_data_dir = "node_data"
 
+
+# Seeding server
+max_uploads = 8  # Số leecher được phục vụ cùng lúc
+listen_backlog = 32  # Số kết nối chờ accept khi đã đủ max_uploads
+
+# Engine kết nối peer: "threads" (mỗi kết nối một thread) hoặc "asyncio" (một event loop cho cả node)
+peer_engine = "threads"
+
+# Số REQUEST_PIECE tối đa đang chờ PIECE_DATA trên mỗi kết nối
+request_window = 8
+
+# Sub-block: kích thước block khi peer hỗ trợ "blocks" và số block đang chờ trên mỗi kết nối
+block_size = 16 * 1024
+block_request_window = 64
+
+# Torrent mới chia sẻ kèm hash SHA-256 từng block (cây Merkle mỗi piece): block hỏng chỉ phải tải lại block đó.
+# Tắt mặc định: các hash (32 byte mỗi block 16 KB) nằm trong file .torrent mà tracker gửi kèm mỗi lần tra peer
+merkle_block_hashes = False
+max_bad_blocks = 4  # Số block/piece sai hash trước khi cấm peer khỏi download
+
+# Peer pool của mỗi download
+max_peer_connections = 30  # Số nguồn tải tối đa cùng lúc
+min_peer_rate = 32 * 1024  # bytes/s, peer chậm hơn sẽ bị thay thế
+slow_peer_grace = 10  # Giây cho peer mới trước khi xét tốc độ
+
+# Số thread tính SHA-1 khi chia sẻ file (None = số core)
+hash_workers = None
+
+# Kiểm tra lại piece đã tải khi tiếp tục download sau khi khởi động lại
+resume_verify_workers = 2
+resume_verify_rate = 64 * 1024 * 1024  # bytes/s đọc đĩa, None = không giới hạn
+
+# Tracker client
+tracker_timeout = 10  # Giây cho mỗi request tới tracker
+tracker_pool_size = 8  # Số kết nối keep-alive tới tracker
+announce_batch_ranges = 512  # Số đoạn piece tối đa trong một request batch
+announce_interval = 2  # Giây giữa hai lần gửi các piece mới tải xong cho tracker
+
+# Làm mới danh sách peer/piece từ tracker trong lúc tải (giây)
+peer_refresh_interval = 30
+
+# Giới hạn băng thông (bytes/s, None = không giới hạn), đổi lúc chạy qua Node.rate_limiter
+max_upload_rate = None
+max_download_rate = None
+peer_upload_rate = None  # Cho mỗi peer
+peer_download_rate = None
+
+# Logging
+log_level = "INFO"
+log_buffer_size = 2000  # Số dòng log gần nhất GUI giữ trong bộ nhớ
+log_messages = False  # Log từng message peer (rất nhiều, chỉ bật khi debug)
+
+# Cổng HTTP trên localhost cho /metrics (Prometheus) và /metrics.json, None = tắt
+metrics_port = 9464
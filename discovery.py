@@ -0,0 +1,109 @@
+import os, json, base64, logging, threading, bencodepy
+from metadata import TorrentMetadata, info_hash_from_magnet
+from config import peer_refresh_interval
+
+logger = logging.getLogger(__name__)
+
+
+class PeerDiscovery(threading.Thread):
+    """Lấy danh sách peer/piece của torrent từ tracker và làm mới định kỳ.
+
+    The first lookup() of a torrent fetches the peer list and, only if it is
+    not already known, decodes the torrent and writes the .torrent and
+    _decoded.json files; metadata is cached on the Node by info-hash. Torrents
+    being downloaded are watch()ed: this thread refreshes their piece -> nodes
+    map every interval and hands it to the registered callback, and
+    request_refresh() asks for an early refresh without blocking the caller.
+    """
+
+    MIN_REFRESH = 5  # Giây tối thiểu giữa hai lần làm mới, kể cả khi request_refresh() liên tục
+
+    def __init__(self, node, interval=peer_refresh_interval):
+        super().__init__()
+        self.daemon = True
+        self.node = node
+        self.interval = interval
+        self.watched = {}  # {magnet_link: callback(pieces_info)}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    def lookup(self, magnet_link):
+        """peers_data {'name', 'pieces'} của torrent, None nếu lỗi"""
+        key = info_hash_from_magnet(magnet_link) or magnet_link
+        try:
+            response = self.node.tracker.get_peers(magnet_link)
+            if response.status_code != 200:
+                logger.warning("Lỗi khi lấy thông tin peers: %s", response.status_code)
+                return None
+            peers_data = self._parse_response(key, response.json())
+        except Exception as e:
+            logger.exception("Lỗi khi lấy thông tin peers: %s", e)
+            return None
+        return peers_data
+
+    def lookup_async(self, magnet_link, callback):
+        """lookup() trên thread riêng, gọi callback(peers_data) khi xong (không chặn GUI)"""
+        thread = threading.Thread(target=lambda: callback(self.lookup(magnet_link)))
+        thread.daemon = True
+        thread.start()
+
+    def _parse_response(self, info_hash, data):
+        with self.node.metadata_lock:
+            metadata = self.node.metadata_cache.get(info_hash)
+        torrent_path = os.path.join(self.node.torrent_dir, f"{data['name']}.torrent")
+        decoded_json_path = os.path.join(self.node.torrent_dir, f"{data['name']}_decoded.json")
+
+        # Chỉ giải mã và ghi file torrent khi chưa có trên đĩa
+        if 'torrentFile' in data and (metadata is None or not os.path.exists(torrent_path)):
+            torrent_data = base64.b64decode(data['torrentFile'])
+            with open(torrent_path, 'wb') as f:
+                f.write(torrent_data)
+            logger.info("Đã lưu file torrent: %s", torrent_path)
+
+            metadata = TorrentMetadata.from_torrent(bencodepy.decode(torrent_data))
+            self.node.cache_metadata(metadata)
+            with open(decoded_json_path, 'w', encoding='utf-8') as f:
+                json.dump(metadata.to_decoded_json(), f, indent=2)
+            logger.info("Đã lưu file decoded JSON: %s", decoded_json_path)
+
+        return {
+            'name': data['name'],
+            'pieces': data.get('pieces', [])
+        }
+
+    def watch(self, magnet_link, callback):
+        """Làm mới nguồn của torrent định kỳ, gọi callback(pieces_info) mỗi lần"""
+        with self.lock:
+            self.watched[magnet_link] = callback
+        if not self.is_alive():
+            self.start()
+
+    def unwatch(self, magnet_link):
+        with self.lock:
+            self.watched.pop(magnet_link, None)
+
+    def request_refresh(self):
+        """Yêu cầu làm mới sớm (ví dụ khi hết peer để kết nối), không chờ kết quả"""
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                break
+            with self.lock:
+                watched = list(self.watched.items())
+            for magnet_link, callback in watched:
+                peers_data = self.lookup(magnet_link)
+                if peers_data:
+                    try:
+                        callback(peers_data['pieces'])
+                    except Exception as e:
+                        logger.error("Lỗi khi cập nhật nguồn tải: %s", e)
+            self.stopped.wait(self.MIN_REFRESH)
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
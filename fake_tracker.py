@@ -0,0 +1,169 @@
+import json, base64, logging, argparse, threading, bencodepy
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from metadata import HASH_LENGTH
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_multipart(content_type, body):
+    """{tên field: bytes} của body multipart/form-data"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+    )
+    return {
+        part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+        for part in message.iter_parts()
+    }
+
+
+class FakeTracker:
+    """Tracker giả trong bộ nhớ, chạy trên localhost cho benchmark và thử nghiệm.
+
+    Implements the endpoints the node uses: POST /api/nodes, POST /api/files
+    (multipart .torrent upload; the sharer becomes a source of every piece),
+    POST /api/files/peers, PUT /api/pieces and PUT /api/pieces/batch.
+    Everything is kept in memory for the lifetime of the server. With
+    batch=False it answers 404 to /api/pieces/batch like an older tracker.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, batch=True):
+        self.lock = threading.Lock()
+        self.batch = batch
+        self.nodes = set()  # {(ip, port)}
+        self.files = {}  # {magnet_link: {'name', 'torrent', 'sources': [set((ip, port)) theo piece]}}
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_file(self, magnet_link, name, torrent_data, ip, port):
+        info = bencodepy.decode(torrent_data)[b'info']
+        piece_count = len(info[b'pieces']) // HASH_LENGTH
+        with self.lock:
+            entry = self.files.get(magnet_link)
+            if entry is None:
+                entry = self.files[magnet_link] = {
+                    'name': name,
+                    'torrent': torrent_data,
+                    'sources': [set() for _ in range(piece_count)]
+                }
+            for sources in entry['sources']:
+                sources.add((ip, port))
+
+    def add_pieces(self, magnet_link, piece_indices, ip, port):
+        with self.lock:
+            entry = self.files.get(magnet_link)
+            if entry is None:
+                return False
+            for piece_index in piece_indices:
+                if 0 <= piece_index < len(entry['sources']):
+                    entry['sources'][piece_index].add((ip, port))
+            return True
+
+    def peers(self, magnet_link):
+        with self.lock:
+            entry = self.files.get(magnet_link)
+            if entry is None:
+                return None
+            return {
+                'name': entry['name'],
+                'torrentFile': base64.b64encode(entry['torrent']).decode('ascii'),
+                'pieces': [
+                    {'piece_index': piece_index, 'nodes': [{'ip': ip, 'port': port} for ip, port in sorted(sources)]}
+                    for piece_index, sources in enumerate(entry['sources'])
+                ]
+            }
+
+    def _handler(self):
+        tracker = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive như tracker thật
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            def _reply(self, status, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                tracker.requests += 1
+                body = self._body()
+                if self.path == "/api/nodes":
+                    data = json.loads(body)
+                    with tracker.lock:
+                        tracker.nodes.add((data['ip'], int(data['port'])))
+                    return self._reply(200, {'nodes': len(tracker.nodes)})
+                if self.path == "/api/files":
+                    fields = _parse_multipart(self.headers['Content-Type'], body)
+                    tracker.add_file(
+                        fields['magnet_text'].decode('utf-8'),
+                        fields['name'].decode('utf-8'),
+                        fields['torrent_file'],
+                        fields['ip'].decode('utf-8'),
+                        int(fields['port'])
+                    )
+                    return self._reply(200, {'message': 'ok'})
+                if self.path == "/api/files/peers":
+                    peers = tracker.peers(json.loads(body)['magnet_text'])
+                    if peers is None:
+                        return self._reply(404, {'message': 'File not found'})
+                    return self._reply(200, peers)
+                self._reply(404, {'message': 'Not found'})
+
+            def do_PUT(self):
+                tracker.requests += 1
+                data = json.loads(self._body())
+                if self.path == "/api/pieces":
+                    piece_indices = [int(data['piece_index'])]
+                elif self.path == "/api/pieces/batch" and tracker.batch:
+                    piece_indices = [i for start, end in data['ranges'] for i in range(start, end + 1)]
+                else:
+                    return self._reply(404, {'message': 'Not found'})
+                if not tracker.add_pieces(data['magnet_text'], piece_indices, data['ip'], int(data['port'])):
+                    return self._reply(404, {'message': 'File not found'})
+                self._reply(200, {'message': 'ok'})
+
+            def log_message(self, format, *args):
+                logger.debug("Tracker: " + format, *args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tracker giả trong bộ nhớ để thử nghiệm trên máy cục bộ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    tracker = FakeTracker(args.host, args.port)
+    logger.info("Fake tracker: %s", tracker.url)
+    try:
+        tracker.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
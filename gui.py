@@ -1,15 +1,22 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, simpledialog, messagebox
 from node import Node
+from log import setup_logging
+from config import log_buffer_size
 import threading
+import logging
 import os 
-import sys  
-import io   
+
+logger = logging.getLogger(__name__)
 
 class NodeGUI:
     def __init__(self, master):
         self.master = master
+        # Log hiển thị trong GUI lấy từ ring buffer, chỉ giữ log_buffer_size dòng gần nhất
+        self.log_handler = setup_logging(buffer_size=log_buffer_size)
+        self.log_total = 0
         self.node = Node()
+        self.downloading = False  # Có download đang chạy ở lần cập nhật trước
         master.title("P2P File Sharing")
         
         # Frame chính
@@ -21,12 +28,16 @@ class NodeGUI:
         info_frame.pack(fill=tk.X, pady=5)
         ttk.Label(info_frame, text=f"IP: {self.node.ip}").pack(side=tk.LEFT, padx=5)
         ttk.Label(info_frame, text=f"Port: {self.node.port}").pack(side=tk.LEFT, padx=5)
+        self.rate_label = ttk.Label(info_frame, text="")
+        self.rate_label.pack(side=tk.RIGHT, padx=5)
         
         # Frame điều khiển
         control_frame = ttk.LabelFrame(main_frame, text="Điều khiển", padding="5")
         control_frame.pack(fill=tk.X, pady=5)
         ttk.Button(control_frame, text="Chia sẻ file", command=self.share_file).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="Chia sẻ thư mục", command=self.share_directory).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame, text="Tải file", command=self.download_file).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="Giới hạn tốc độ", command=self.set_rate_limits).pack(side=tk.LEFT, padx=5)
         
         # Frame tiến độ
         progress_frame = ttk.LabelFrame(main_frame, text="Tiến độ", padding="5")
@@ -55,10 +66,6 @@ class NodeGUI:
         self.node_thread.daemon = True
         self.node_thread.start()
         self.node.start_listening()
-        
-        # Thêm StringIO để capture output
-        self.output_buffer = io.StringIO()
-        sys.stdout = self.output_buffer
 
         # Cập nhật GUI định kỳ
         self.update_gui()
@@ -69,42 +76,63 @@ class NodeGUI:
     def update_gui(self):
         """Cập nhật GUI mỗi giây"""
         try:
-            if self.node.current_file_name:
-                # Đếm số piece đã tải trong thư mục
-                piece_dir = os.path.join(self.node.pieces_dir, self.node.current_file_name)
-                if os.path.exists(piece_dir):
-                    completed_pieces = len([f for f in os.listdir(piece_dir) if f.startswith('piece_')])
-                    
-                    # Lấy tổng số piece từ torrent_info
-                    torrent_info = self.node.get_decoded_torrent_info()
-                    if torrent_info:
-                        total_pieces = len(torrent_info['pieces'])
-                        
-                        # Cập nhật thanh tiến độ
-                        progress = (completed_pieces / total_pieces) * 100 if total_pieces > 0 else 0
-                        self.progress_var.set(progress)
-                        
-                        # Cập nhật nhãn trạng thái
-                        if completed_pieces == total_pieces:
-                            self.status_label.config(text=f"Đã tải xong file: {self.node.current_file_name}")
-                        else:
-                            self.status_label.config(text=f"Đang tải: {completed_pieces}/{total_pieces} pieces ({progress:.1f}%)")
+            sessions = self.node.download_manager.sessions()
+            if sessions:
+                # Số piece đã tải lấy từ bitfield của từng download, không cần quét thư mục
+                lines = []
+                completed_total, pieces_total = 0, 0
+                for session in sessions:
+                    completed_pieces, total_pieces = session.progress()
+                    completed_total += completed_pieces
+                    pieces_total += total_pieces
+                    lines.append(f"Đang tải {session.name}: {completed_pieces}/{total_pieces} pieces")
+
+                # Thanh tiến độ tính trên tổng số piece của mọi download
+                progress = (completed_total / pieces_total) * 100 if pieces_total > 0 else 0
+                self.progress_var.set(progress)
+                self.status_label.config(text="\n".join(lines))
+                self.downloading = True
+            elif self.downloading:
+                self.progress_var.set(100)
+                self.status_label.config(text="Đã tải xong tất cả file")
+                self.downloading = False
+
+            rates = self.node.rate_limiter.rates()
+            self.rate_label.config(
+                text=f"↑ {rates['upload']['total'] / 1024:.0f} KB/s  ↓ {rates['download']['total'] / 1024:.0f} KB/s"
+            )
             
-            # Lấy output từ buffer và hiển thị vào details_text
-            output = self.output_buffer.getvalue()
-            if output:
-                self.details_text.delete(1.0, tk.END)
-                self.details_text.insert(tk.END, output)
-                self.details_text.see(tk.END)  # Tự động cuộn xuốngg
-                self.output_buffer.truncate(0)
-                self.output_buffer.seek(0)
+            # Chỉ thêm các dòng log mới, bỏ bớt dòng cũ nhất khi vượt quá buffer
+            if self.log_handler:
+                lines, self.log_total = self.log_handler.since(self.log_total)
+                if lines:
+                    self.details_text.insert(tk.END, "\n".join(lines) + "\n")
+                    extra = int(self.details_text.index('end-1c').split('.')[0]) - 1 - log_buffer_size
+                    if extra > 0:
+                        self.details_text.delete(1.0, f"{extra + 1}.0")
+                    self.details_text.see(tk.END)  # Tự động cuộn xuốngg
 
         except Exception as e:
-            print(f"Lỗi cập nhật GUI: {e}")
+            logger.error("Lỗi cập nhật GUI: %s", e)
         finally:
             self.master.after(1000, self.update_gui)
 
 
+    def set_rate_limits(self):
+        """Đổi giới hạn upload/download toàn cục (KB/s, 0 = không giới hạn)"""
+        rates = self.node.rate_limiter.rates()
+        for direction, title in (("upload", "Upload"), ("download", "Download")):
+            limit = rates[direction]['limit']
+            value = simpledialog.askinteger(
+                "Giới hạn tốc độ",
+                f"{title} tối đa (KB/s, 0 = không giới hạn):",
+                initialvalue=int(limit / 1024) if limit else 0,
+                minvalue=0
+            )
+            if value is None:
+                return
+            self.node.rate_limiter.set_global_rate(direction, value * 1024 or None)
+
     def share_file(self):
         file_path = filedialog.askopenfilename()
         if file_path:
@@ -112,6 +140,13 @@ class NodeGUI:
             self.status_label.config(text="Đang xử lý file...")
             self.node.share_file(file_path, self.update_share_progress)
 
+    def share_directory(self):
+        dir_path = filedialog.askdirectory()
+        if dir_path:
+            self.progress_var.set(0)
+            self.status_label.config(text="Đang xử lý thư mục...")
+            self.node.share_file(dir_path, self.update_share_progress)
+
     def update_share_progress(self, current, total, magnet_link=None, torrent_path=None):
         progress = (current / total) * 100
         self.progress_var.set(progress)
@@ -131,24 +166,28 @@ class NodeGUI:
     def download_file(self):
         magnet_link = simpledialog.askstring("Tải file", "Nhập magnet link:")
         if magnet_link:
-            peers_data = self.node.get_peers_for_file(magnet_link)
-            if peers_data:
-                if isinstance(peers_data, dict) and 'name' in peers_data:
-                    self.node.current_file_name = peers_data['name']
-                    self.node.current_magnet_link = magnet_link
-                    
-                    # Bắt đầu tải từ nhiều nguồn
-                    self.node.connect_and_request_pieces(peers_data)
-                    
-                    num_pieces = len(peers_data.get('pieces', []))
-                    self.status_label.config(text=f"Đang tải {num_pieces} pieces từ nhiều nguồn...")
-                else:
-                    messagebox.showerror("Lỗi", "Dữ liệu peers không hợp lệ")
+            # Hỏi tracker trên thread nền để GUI không bị treo
+            self.status_label.config(text="Đang lấy danh sách peer...")
+            self.node.discovery.lookup_async(
+                magnet_link,
+                lambda peers_data: self.master.after(0, self.start_download, magnet_link, peers_data)
+            )
+
+    def start_download(self, magnet_link, peers_data):
+        if peers_data:
+            if isinstance(peers_data, dict) and 'name' in peers_data:
+                # Bắt đầu tải từ nhiều nguồn, song song với các download khác
+                self.node.start_download(magnet_link, peers_data)
+                
+                num_pieces = len(peers_data.get('pieces', []))
+                self.status_label.config(text=f"Đang tải {num_pieces} pieces từ nhiều nguồn...")
+            else:
+                messagebox.showerror("Lỗi", "Dữ liệu peers không hợp lệ")
+        else:
+            self.status_label.config(text="Không lấy được danh sách peer")
 
     def on_closing(self):
         if messagebox.askokcancel("Thoát", "Bạn có muốn thoát không?"):
-            # Khôi phục stdout gốc
-            sys.stdout = sys.__stdout__
             self.node.stop()
             self.master.destroy()
             os._exit(0)
@@ -0,0 +1,109 @@
+import os, math, hashlib, collections, concurrent.futures
+
+HASH_LENGTH = 20  # SHA-1 digest
+MERKLE_HASH_LENGTH = 32  # SHA-256 digest của block và nút cây Merkle
+READ_SIZE = 8 * 1024 * 1024  # Mỗi lần đọc ~8 MB, làm tròn theo piece
+
+
+def merkle_root(leaves):
+    """Gốc cây Merkle SHA-256 trên hash các block, thêm lá 0 cho đủ lũy thừa của 2"""
+    layer = list(leaves)
+    width = 1
+    while width < len(layer):
+        width *= 2
+    layer += [bytes(MERKLE_HASH_LENGTH)] * (width - len(layer))
+    while len(layer) > 1:
+        layer = [hashlib.sha256(layer[i] + layer[i + 1]).digest() for i in range(0, len(layer), 2)]
+    return layer[0]
+
+
+def piece_roots(block_digests, blocks_per_piece):
+    """Gốc Merkle của từng piece (nối liền, 32 byte/piece) từ hash các block nối liền"""
+    layer_size = blocks_per_piece * MERKLE_HASH_LENGTH
+    return b''.join(
+        merkle_root([block_digests[i:i + MERKLE_HASH_LENGTH]
+                     for i in range(start, min(start + layer_size, len(block_digests)), MERKLE_HASH_LENGTH)])
+        for start in range(0, len(block_digests), layer_size)
+    )
+
+
+def _hash_chunk(data, piece_length, block_size=None):
+    """(SHA-1 các piece, SHA-256 các block nếu có block_size) của một đoạn dữ liệu"""
+    view = memoryview(data)
+    pieces = b''.join(
+        hashlib.sha1(view[offset:offset + piece_length]).digest()
+        for offset in range(0, len(data), piece_length)
+    )
+    if not block_size:
+        return pieces, b''
+    # Piece length là bội của block_size nên block không vắt qua hai piece
+    blocks = b''.join(
+        hashlib.sha256(view[offset:offset + block_size]).digest()
+        for offset in range(0, len(data), block_size)
+    )
+    return pieces, blocks
+
+
+def _read_stream(paths, size):
+    """Đọc nối tiếp các file như một luồng byte, mỗi lần size byte (lần cuối có thể ngắn hơn)"""
+    buffer = bytearray()
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(size - len(buffer))
+                if not data:
+                    break
+                # Trường hợp thường gặp (file lớn): trả thẳng dữ liệu, không copy
+                if not buffer and len(data) == size:
+                    yield data
+                    continue
+                buffer += data
+                if len(buffer) == size:
+                    yield bytes(buffer)
+                    buffer = bytearray()
+    if buffer:
+        yield bytes(buffer)
+
+
+def hash_files(paths, piece_length, callback=None, workers=None, block_size=None):
+    """SHA-1 của từng piece của các file nối liền nhau (torrent nhiều file).
+
+    The files are read sequentially as one stream, in large piece-aligned
+    chunks, so pieces span file boundaries, and each chunk is hashed on a
+    thread pool; hashlib releases the GIL, so this scales with cores while
+    the reader keeps the disk busy. At most a few chunks per worker are held
+    in memory. callback(done, total) is called in order.
+
+    Returns (piece digests, block digests): with block_size (a divisor of
+    piece_length) the SHA-256 of every block is computed in the same pass,
+    otherwise the block digests are empty.
+    """
+    total_size = sum(os.path.getsize(path) for path in paths)
+    total_pieces = math.ceil(total_size / piece_length)
+    digests = bytearray(HASH_LENGTH * total_pieces)
+    block_digests = bytearray(MERKLE_HASH_LENGTH * math.ceil(total_size / block_size) if block_size else 0)
+    blocks_per_piece = piece_length // block_size if block_size else 0
+    workers = workers or os.cpu_count() or 1
+    chunk_pieces = max(1, READ_SIZE // piece_length)
+    max_pending = 2 * workers
+
+    def collect(first_piece, future):
+        chunk_digests, chunk_blocks = future.result()
+        start = first_piece * HASH_LENGTH
+        digests[start:start + len(chunk_digests)] = chunk_digests
+        start = first_piece * blocks_per_piece * MERKLE_HASH_LENGTH
+        block_digests[start:start + len(chunk_blocks)] = chunk_blocks
+        if callback:
+            callback(first_piece + len(chunk_digests) // HASH_LENGTH, total_pieces)
+
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        chunks = _read_stream(paths, chunk_pieces * piece_length)
+        for first_piece, data in zip(range(0, total_pieces, chunk_pieces), chunks):
+            pending.append((first_piece, pool.submit(_hash_chunk, data, piece_length, block_size)))
+            while len(pending) >= max_pending:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+
+    return bytes(digests), bytes(block_digests)
@@ -0,0 +1,68 @@
+import sys, logging, threading, collections
+from config import log_level, log_buffer_size, log_messages
+
+# Logger riêng cho từng message peer, tắt mặc định vì rất nhiều
+MESSAGE_LOGGER = "protocol.messages"
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+TIME_FORMAT = "%H:%M:%S"
+
+_setup_lock = threading.Lock()
+_ring_handler = None
+_configured = False
+
+
+class RingBufferHandler(logging.Handler):
+    """Giữ capacity bản ghi log gần nhất trong bộ nhớ cho GUI.
+
+    Records are stored unformatted and only formatted when the GUI asks for
+    them, so lines that scroll out of the buffer between two refreshes cost
+    nothing. total counts every record ever received; a reader passes the
+    total from its previous call to since() and gets only the new lines.
+    """
+
+    def __init__(self, capacity=log_buffer_size):
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+        self.total = 0
+
+    def emit(self, record):
+        # Handler.handle() đã giữ self.lock khi gọi emit()
+        self.records.append(record)
+        self.total += 1
+
+    def since(self, total):
+        """(các dòng mới kể từ mốc total, mốc mới)"""
+        self.acquire()
+        try:
+            count = min(self.total - total, len(self.records))
+            records = list(self.records)[len(self.records) - count:] if count > 0 else []
+            total = self.total
+        finally:
+            self.release()
+        return [self.format(record) for record in records], total
+
+
+def setup_logging(level=log_level, buffer_size=None, stream=sys.stderr):
+    """Cấu hình logging cho node (chỉ lần gọi đầu có hiệu lực).
+
+    Trả về RingBufferHandler nếu có buffer_size (cho GUI), ngược lại None.
+    """
+    global _configured, _ring_handler
+    with _setup_lock:
+        if _configured:
+            return _ring_handler
+        _configured = True
+        formatter = logging.Formatter(LOG_FORMAT, TIME_FORMAT)
+        root = logging.getLogger()
+        root.setLevel(level)
+        if stream is not None:
+            stream_handler = logging.StreamHandler(stream)
+            stream_handler.setFormatter(formatter)
+            root.addHandler(stream_handler)
+        if buffer_size:
+            _ring_handler = RingBufferHandler(buffer_size)
+            _ring_handler.setFormatter(formatter)
+            root.addHandler(_ring_handler)
+        logging.getLogger(MESSAGE_LOGGER).setLevel(logging.DEBUG if log_messages else logging.WARNING)
+        return _ring_handler
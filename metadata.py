@@ -0,0 +1,153 @@
+import math, hashlib, urllib.parse, bencodepy
+from hashing import HASH_LENGTH, MERKLE_HASH_LENGTH, merkle_root
+
+
+def info_hash_from_magnet(magnet_link):
+    """Lấy info-hash (hex, chữ thường) từ magnet link, None nếu không có"""
+    query = urllib.parse.urlparse(magnet_link).query
+    for xt in urllib.parse.parse_qs(query).get('xt', []):
+        if xt.startswith('urn:btih:'):
+            return xt[len('urn:btih:'):].lower()
+    return None
+
+
+class TorrentMetadata:
+    """Parsed torrent info kept in memory, with raw 20-byte piece digests.
+
+    Multi-file torrents (a shared directory) list their files in order; the
+    pieces cover the concatenation of all files and length is the total.
+
+    Torrents may also carry block hashes: info holds a SHA-256 Merkle root
+    per piece over its block_size blocks ('piece roots', covered by the info
+    hash), and the torrent holds the leaf hashes themselves ('piece layers',
+    checked against the roots on load). With them, each block is verified as
+    it arrives and a corrupt block costs one block instead of a whole piece.
+    """
+
+    def __init__(self, info_hash, name, piece_length, length, piece_hashes, files=None,
+                 block_size=None, piece_roots=None, block_hashes=None):
+        self.info_hash = info_hash
+        self.name = name
+        self.piece_length = piece_length
+        self.length = length
+        self.piece_hashes = piece_hashes  # list[bytes], mỗi phần tử 20 byte
+        self.files = files  # [(list tên thư mục/file, độ dài)] nếu nhiều file, None nếu một file
+        self.block_size = block_size  # Kích thước block của cây Merkle, None nếu torrent không có
+        self.piece_roots = piece_roots  # list[bytes], gốc Merkle SHA-256 của từng piece
+        self.block_hashes = block_hashes  # list[list[bytes]], hash SHA-256 của từng block theo piece
+
+    @classmethod
+    def from_info(cls, info, piece_layers=None):
+        """Build from the bencoded-decoded info dict of a .torrent file.
+
+        piece_layers is the torrent's concatenated block hashes, if any;
+        ValueError is raised when they do not match the piece roots.
+        """
+        pieces = info[b'pieces']
+        files = None
+        if b'files' in info:
+            files = [
+                ([component.decode('utf-8') for component in file_info[b'path']], file_info[b'length'])
+                for file_info in info[b'files']
+            ]
+        metadata = cls(
+            info_hash=hashlib.sha1(bencodepy.encode(info)).hexdigest(),
+            name=info[b'name'].decode('utf-8'),
+            piece_length=info[b'piece length'],
+            length=sum(length for _, length in files) if files else info[b'length'],
+            piece_hashes=[pieces[i:i + HASH_LENGTH] for i in range(0, len(pieces), HASH_LENGTH)],
+            files=files
+        )
+        if b'piece roots' in info:
+            roots = info[b'piece roots']
+            metadata.block_size = info[b'block size']
+            metadata.piece_roots = [
+                roots[i:i + MERKLE_HASH_LENGTH] for i in range(0, len(roots), MERKLE_HASH_LENGTH)
+            ]
+            if piece_layers:
+                metadata.set_block_hashes(piece_layers)
+        return metadata
+
+    @classmethod
+    def from_torrent(cls, torrent):
+        """Build from a whole bencoded-decoded .torrent dict (info and piece layers)"""
+        return cls.from_info(torrent[b'info'], torrent.get(b'piece layers'))
+
+    @classmethod
+    def from_torrent_file(cls, torrent_path):
+        with open(torrent_path, 'rb') as f:
+            return cls.from_torrent(bencodepy.decode(f.read()))
+
+    @classmethod
+    def from_decoded_json(cls, info_hash, decoded_info):
+        """Build from a *_decoded.json dict (hex piece hashes)"""
+        return cls(
+            info_hash=info_hash,
+            name=decoded_info['name'],
+            piece_length=decoded_info['piece length'],
+            length=decoded_info['length'],
+            piece_hashes=[bytes.fromhex(piece_hash) for piece_hash in decoded_info['pieces']],
+            files=[(file_info['path'], file_info['length']) for file_info in decoded_info['files']]
+            if 'files' in decoded_info else None,
+            block_size=decoded_info.get('block size'),
+            piece_roots=[bytes.fromhex(root) for root in decoded_info['piece roots']]
+            if 'piece roots' in decoded_info else None,
+            block_hashes=[[bytes.fromhex(leaf) for leaf in leaves] for leaves in decoded_info['piece layers']]
+            if 'piece layers' in decoded_info else None
+        )
+
+    @property
+    def piece_count(self):
+        return len(self.piece_hashes)
+
+    def piece_size(self, piece_index):
+        """Kích thước thực của piece (piece cuối có thể ngắn hơn piece length)"""
+        return min(self.piece_length, self.length - piece_index * self.piece_length)
+
+    @property
+    def has_block_hashes(self):
+        return self.block_hashes is not None
+
+    def set_block_hashes(self, piece_layers):
+        """Tách hash các block theo piece và kiểm tra với gốc Merkle của từng piece"""
+        if len(self.piece_roots) != self.piece_count:
+            raise ValueError("Number of piece roots does not match the number of pieces")
+        block_hashes, start = [], 0
+        for piece_index, root in enumerate(self.piece_roots):
+            count = math.ceil(self.piece_size(piece_index) / self.block_size)
+            end = start + count * MERKLE_HASH_LENGTH
+            leaves = [piece_layers[i:i + MERKLE_HASH_LENGTH] for i in range(start, end, MERKLE_HASH_LENGTH)]
+            if merkle_root(leaves) != root:
+                raise ValueError(f"Piece layers do not match the root of piece {piece_index}")
+            block_hashes.append(leaves)
+            start = end
+        if start != len(piece_layers):
+            raise ValueError("Piece layers have the wrong length")
+        self.block_hashes = block_hashes
+
+    def verify_block(self, piece_index, offset, block_data):
+        """Kiểm tra một block với hash SHA-256 của nó (True nếu torrent không có block hash)"""
+        if self.block_hashes is None:
+            return True
+        block_index, remainder = divmod(offset, self.block_size)
+        leaves = self.block_hashes[piece_index]
+        if remainder or block_index >= len(leaves):
+            return False
+        expected_length = min(self.block_size, self.piece_size(piece_index) - offset)
+        return len(block_data) == expected_length and hashlib.sha256(block_data).digest() == leaves[block_index]
+
+    def to_decoded_json(self):
+        decoded = {
+            'name': self.name,
+            'piece length': self.piece_length,
+            'pieces': [piece_hash.hex() for piece_hash in self.piece_hashes],
+            'length': self.length
+        }
+        if self.files:
+            decoded['files'] = [{'path': path, 'length': length} for path, length in self.files]
+        if self.piece_roots is not None:
+            decoded['block size'] = self.block_size
+            decoded['piece roots'] = [root.hex() for root in self.piece_roots]
+        if self.block_hashes is not None:
+            decoded['piece layers'] = [[leaf.hex() for leaf in leaves] for leaves in self.block_hashes]
+        return decoded
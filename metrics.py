@@ -0,0 +1,245 @@
+import json, time, bisect, logging, threading, contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# Giây, đủ rộng cho cả hash một block lẫn request tới tracker ở xa
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of Counter/Gauge/Histogram: one value per combination of label values"""
+
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # {tuple giá trị label: giá trị}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _labels(self, key):
+        return dict(zip(self.label_names, key))
+
+    def samples(self):
+        """[(hậu tố tên, labels, giá trị)] để xuất Prometheus"""
+        with self.lock:
+            values = list(self.values.items())
+        return [('', self._labels(key), value) for key, value in values]
+
+    def snapshot(self):
+        return [{'labels': labels, 'value': value} for _, labels, value in self.samples()]
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge set directly, or computed at collection time by collect().
+
+    collect() returns a number, or a dict {tuple of label values: number}
+    for a labelled gauge; it runs only when the metrics are read, so hot
+    paths pay nothing for values that already exist elsewhere.
+    """
+
+    TYPE = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.collect is None:
+            return super().samples()
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.warning("Lỗi khi lấy giá trị metric %s: %s", self.name, e)
+            return []
+        if not isinstance(values, dict):
+            return [('', {}, values)]
+        return [('', self._labels(tuple(str(v) for v in key)), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # [số lần theo bucket (không cộng dồn, thêm bucket +Inf), tổng, số lần]
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _states(self):
+        with self.lock:
+            return [(self._labels(key), list(state[0]), state[1], state[2]) for key, state in self.values.items()]
+
+    def samples(self):
+        samples = []
+        for labels, counts, total, count in self._states():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+    def snapshot(self):
+        snapshot = []
+        for labels, counts, total, count in self._states():
+            cumulative, buckets = 0, {}
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                buckets[_format_value(bound)] = cumulative
+            snapshot.append({'labels': labels, 'count': count, 'sum': total, 'buckets': buckets})
+        return snapshot
+
+
+class MetricsRegistry:
+    """Các metric của một Node, xuất dạng Prometheus text hoặc snapshot dict.
+
+    counter()/gauge()/histogram() return the existing metric when the name is
+    already registered, so each component can look up what it records once
+    (e.g. per connection) without a central list of definitions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # {name: Metric}, theo thứ tự đăng ký
+
+    def _get_or_create(self, cls, name, help, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.TYPE}")
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get_or_create(Counter, name, help, labels=labels)
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self._get_or_create(Gauge, name, help, labels=labels, collect=collect)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labels=labels, buckets=buckets)
+
+    def snapshot(self):
+        """{name: {'type', 'help', 'values'}} của mọi metric"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            metric.name: {'type': metric.TYPE, 'help': metric.help, 'values': metric.snapshot()}
+            for metric in metrics
+        }
+
+    def render(self):
+        """Định dạng text của Prometheus (exposition format 0.0.4)"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(threading.Thread):
+    """HTTP server trên localhost: /metrics (Prometheus) và /metrics.json (snapshot)"""
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        super().__init__()
+        self.daemon = True
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == "/metrics":
+                    body = registry.render().encode('utf-8')
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif path == "/metrics.json":
+                    body = json.dumps(registry.snapshot()).encode('utf-8')
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics: " + format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    def run(self):
+        logger.info("Metrics: http://%s:%s/metrics", *self.server.server_address[:2])
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
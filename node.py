@@ -1,53 +1,52 @@
-import threading, socket, os, json, math, base64, hashlib, requests, bencodepy, traceback, time
-from config import tracker_host
-
-class PeerConnection(threading.Thread):
-    MESSAGE_END = "\n"
-
-    def __init__(self, node, peer_address, assigned_pieces=None, is_initiator=True):
+import threading, socket, os, json, math, bencodepy, logging, time, collections, queue
+import protocol
+from metadata import TorrentMetadata, info_hash_from_magnet
+from storage import FileRegion, open_storage, list_files
+from hashing import hash_files, piece_roots
+from session import DownloadSession
+from async_engine import AsyncPeerEngine
+from tracker_client import TrackerClient, PieceAnnouncer
+from discovery import PeerDiscovery
+from ratelimit import RateLimiter
+from log import setup_logging
+from metrics import MetricsRegistry, MetricsServer
+from config import tracker_host, node_port, node_data_dir, max_uploads, listen_backlog, peer_engine, hash_workers
+from config import max_upload_rate, max_download_rate, peer_upload_rate, peer_download_rate, metrics_port
+from config import block_size, merkle_block_hashes
+
+logger = logging.getLogger(__name__)
+
+class PeerConnection(protocol.PeerProtocol, threading.Thread):
+    """Thread-per-connection transport (receive thread + send thread)"""
+
+    def __init__(self, node, peer_address, session=None, is_initiator=True, sock=None, listener=None):
         super().__init__()
-        self.node = node
-        self.peer_address = peer_address 
-        self.is_initiator = is_initiator
-        self.assigned_pieces = assigned_pieces or []
-        self.sock = None
+        self.daemon = True
+        self._init_protocol(node, peer_address, session, is_initiator)
+        self.sock = sock  # Socket đã accept sẵn khi là seeder
+        self.listener = listener
         self.running = True
-        self.message_queue = []
-        self.queue_lock = threading.Lock()
-        self.buffer = ""
-        self.role = "Leecher" if is_initiator else "Seeder"
+        self.message_queue = collections.deque()
+        self.queue_lock = threading.Condition()
 
     def run(self):
         try:
             self._setup_connection()
             self.handle_connection()
         except Exception as e:
-            print(f"{self.role}: Connection error: {e}")
+            logger.warning("%s: Connection error: %s", self.role, e)
         finally:
             self.cleanup()
 
     def _setup_connection(self):
         if self.is_initiator:
             self._connect_as_leecher() 
-        else:
-            self._listen_as_seeder()
 
     def _connect_as_leecher(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        print(f"{self.role}: Connecting to {self.peer_address[0]}:{self.peer_address[1]}")
+        logger.info("%s: Connecting to %s:%s", self.role, self.peer_address[0], self.peer_address[1])
         self.sock.connect(self.peer_address)
-        print(f"{self.role}: Connected successfully")
-
-    def _listen_as_seeder(self):
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) 
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind(('0.0.0.0', self.node.port))
-        server_socket.listen(1)
-        print(f"{self.role}: Listening on port {self.node.port}")
-        
-        self.sock, client_address = server_socket.accept()
-        print(f"{self.role}: Accepted connection from {client_address[0]}:{client_address[1]}")
-        server_socket.close()
+        logger.debug("%s: Connected successfully", self.role)
 
     def handle_connection(self):
         receive_thread = threading.Thread(target=self._receive_messages)
@@ -59,257 +58,353 @@ class PeerConnection(threading.Thread):
         send_thread.start()
 
         if self.is_initiator:
-            self.queue_message({"type": "HELLO"})
+            self.queue_message(self._hello_message())
 
-        while self.running and receive_thread.is_alive() and send_thread.is_alive():
-            threading.Event().wait(1)
+        # Thread chính chỉ chờ thread nhận kết thúc (peer đóng kết nối hoặc lỗi)
+        receive_thread.join()
 
     def _process_message_queue(self):
-        print(f"{self.role}: Message sending thread started")
+        logger.debug("%s: Message sending thread started", self.role)
         while self.running:
             try:
                 with self.queue_lock:
-                    if self.message_queue:
-                        message = self.message_queue.pop(0)
-                        self._send_message(message)
-                threading.Event().wait(0.1)
+                    # Chờ message mới thay vì poll, timeout để kiểm tra self.running
+                    while self.running and not self.message_queue:
+                        self.queue_lock.wait(1)
+                    if not self.message_queue:
+                        continue
+                    message = self.message_queue.popleft()
+                self.queue_depth.dec(role=self.role)
+                if self._should_send(message):
+                    self._send_message(message)
             except Exception as e:
-                print(f"{self.role}: Message queue error: {e}")
+                logger.warning("%s: Message queue error: %s", self.role, e)
                 break
-        print(f"{self.role}: Message sending thread ended")
+        logger.debug("%s: Message sending thread ended", self.role)
 
     def _send_message(self, message_dict):
         try:
-            message = json.dumps(message_dict) + self.MESSAGE_END
-            log_message = {k: '<binary data>' if k == 'data' else v 
-                         for k, v in message_dict.items()}
-            print(f"{self.role}: Sending message: {json.dumps(log_message)}")
-            
-            self.sock.sendall(message.encode('utf-8'))
-            print(f"{self.role}: Message sent successfully")
+            self._log_message("Sending", message_dict)
+            chunks = self._encode_message(message_dict)
+            delay = self._send_delay(chunks)
+            if delay:
+                time.sleep(delay)
+            start = time.perf_counter()
+            for chunk in chunks:
+                if isinstance(chunk, FileRegion):
+                    chunk.send_to(self.sock)
+                else:
+                    self.sock.sendall(chunk)
+            self._message_sent(message_dict, time.perf_counter() - start)
+            logger.debug("%s: Message sent successfully", self.role)
         except Exception as e:
-            print(f"Message sending error: {e}")
+            logger.warning("Message sending error: %s", e)
             raise
 
     def _receive_messages(self):
-        print(f"{self.role}: Listen thread started")
+        logger.debug("%s: Listen thread started", self.role)
         while self.running:
             try:
                 if not self.sock:
                     break
 
-                data = self.sock.recv(4096)
+                data = self.sock.recv(self.RECV_SIZE)
                 if not data:
                     break
 
-                self.buffer += data.decode('utf-8')
-                while self.MESSAGE_END in self.buffer:
-                    message, self.buffer = self.buffer.split(self.MESSAGE_END, 1)
-                    if message:
-                        self._handle_received_message(message)
+                self.buffer += data
+                self._drain_buffer()
+
+                # Chờ trước lần recv tiếp theo để TCP tự giảm tốc độ gửi của peer
+                delay = self._receive_delay(data)
+                if delay:
+                    time.sleep(delay)
 
             except Exception as e:
-                print(f"{self.role}: Receive error: {e}")
+                logger.warning("%s: Receive error: %s", self.role, e)
                 break
-        print(f"{self.role}: Listen thread ended")
-
-    def _handle_received_message(self, message):
-        message_dict = json.loads(message)
-        log_message = {k: '<binary data>' if k == 'data' else v 
-                      for k, v in message_dict.items()}
-        print(f"{self.role}: Received message: {json.dumps(log_message)}")
-        self._handle_message_type(message_dict)
-
-    def _handle_message_type(self, message):
-        handlers = {
-            "HELLO": self._handle_hello,
-            "HELLO_ACK": self._handle_hello_ack,
-            "REQUEST_PIECE": self._handle_request_piece,
-            "PIECE_DATA": self._handle_piece_data
-        }
-        handler = handlers.get(message.get('type'))
-        if handler:
-            handler(message)
-
-    def _handle_hello(self, _):
-        if not self.is_initiator:
-            self.queue_message({"type": "HELLO_ACK"})
-    
-    def _handle_hello_ack(self, _):
-        if self.is_initiator:
-            self.request_pieces()
-            
-    def _handle_request_piece(self, message):
-        if not self.is_initiator:
-            piece_data = self.node.get_piece_data(
-                message['magnet_link'], 
-                message['piece_index']
-            )
-            if piece_data:
-                self.queue_message({
-                    "type": "PIECE_DATA",
-                    "piece_index": message['piece_index'],
-                    "data": base64.b64encode(piece_data).decode()
-                })
-
-    def _handle_piece_data(self, message):
-        if self.is_initiator:
-            piece_data = base64.b64decode(message['data'])
-            self.node.handle_received_piece(
-                message['piece_index'],
-                piece_data
-            )
-
-    def request_pieces(self):
-        for piece_index in self.assigned_pieces:
-            if piece_index in self.node.get_needed_pieces():
-                self.queue_message({
-                    "type": "REQUEST_PIECE",
-                    "piece_index": piece_index,
-                    "magnet_link": self.node.current_magnet_link
-                })
+        logger.debug("%s: Listen thread ended", self.role)
 
     def queue_message(self, message_dict):
         with self.queue_lock:
+            if not self.running:
+                return
             self.message_queue.append(message_dict)
-
-    def start_listening(self):
-        """Start a new seeder connection to listen for incoming peers"""
-        try:
-            listener = PeerConnection(self, ('0.0.0.0', self.port), is_initiator=False)
-            self.peer_connections.append(listener)
-            listener.start()
-            print(f"Started new listener on port {self.port}")
-        except Exception as e:
-            print(f"Error starting listener: {e}")
+            self.queue_lock.notify()
+        self.queue_depth.inc(role=self.role)
 
     def cleanup(self):
-        """Clean up connection and restart listening if seeder"""
+        """Clean up connection and give the upload slot back to the listener.
+
+        Safe to call more than once and from any thread (the session, the peer
+        pool and run() itself all do); only the first call does the work.
+        """
         try:
-            self.running = False
-            if self.sock:
+            with self.queue_lock:
+                if not self.running:
+                    return
+                self.running = False
+                # Message chưa gửi sẽ không bao giờ được gửi nữa
+                dropped = len(self.message_queue)
+                self.message_queue.clear()
+                self.queue_lock.notify_all()
+                sock, self.sock = self.sock, None
+            self.queue_depth.dec(dropped, role=self.role)
+            if sock:
                 try:
-                    self.sock.shutdown(socket.SHUT_RDWR)
+                    sock.shutdown(socket.SHUT_RDWR)
                 except:
                     pass
-                self.sock.close()
-                self.sock = None
+                sock.close()
+
+            self.release_requests()
+            self.node.rate_limiter.forget_peer(self.peer_address)
+            if self.listener:
+                self.listener.connection_closed(self)
+        except Exception as e:
+            logger.warning("%s: Cleanup error: %s", self.role, e)
+
+class PeerListener(threading.Thread):
+    """Persistent seeding server that serves many leechers at once.
+
+    At most max_uploads connections are served concurrently; further
+    leechers wait in the listen backlog until an upload slot frees up.
+    """
+
+    def __init__(self, node, max_uploads=max_uploads, backlog=listen_backlog):
+        super().__init__()
+        self.daemon = True
+        self.node = node
+        self.max_uploads = max_uploads
+        self.backlog = backlog
+        self.upload_slots = threading.BoundedSemaphore(max_uploads)
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.server_socket = None
+        self.running = True
 
-            # Restart listening if this was a seeder connection
-            if not self.is_initiator:
-                print(f"{self.role}: Restarting listening state...")
+    def run(self):
+        try:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind(('0.0.0.0', self.node.port))
+            self.server_socket.listen(self.backlog)
+            self.server_socket.settimeout(1)
+            logger.info("Seeder: Listening on port %s (max %s uploads)", self.node.port, self.max_uploads)
+
+            while self.running and self.node.running:
+                # Chỉ accept khi còn slot, leecher khác chờ trong backlog
+                if not self.upload_slots.acquire(timeout=1):
+                    continue
                 try:
-                    # Remove self from node's peer connections if present
-                    if self in self.node.peer_connections:
-                        self.node.peer_connections.remove(self)
-                    # Start new listener
-                    self.node.start_listening()
-                except Exception as e:
-                    print(f"{self.role}: Error restarting listener: {e}")
+                    sock, client_address = self.server_socket.accept()
+                except socket.timeout:
+                    self.upload_slots.release()
+                    continue
+                except OSError:
+                    self.upload_slots.release()
+                    break
+
+                sock.settimeout(None)
+                logger.info("Seeder: Accepted connection from %s:%s", client_address[0], client_address[1])
+                conn = PeerConnection(self.node, client_address, is_initiator=False, sock=sock, listener=self)
+                with self.connections_lock:
+                    self.connections.append(conn)
+                conn.start()
         except Exception as e:
-            print(f"{self.role}: Cleanup error: {e}")
+            logger.error("Seeder: Listener error: %s", e)
+        finally:
+            self.stop()
+
+    def connection_closed(self, conn):
+        with self.connections_lock:
+            if conn not in self.connections:
+                return
+            self.connections.remove(conn)
+        self.upload_slots.release()
+
+    @property
+    def active_uploads(self):
+        with self.connections_lock:
+            return len(self.connections)
+
+    def stop(self):
+        self.running = False
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except OSError:
+                pass
 
 class DownloadManager(threading.Thread):
+    """Quản lý các DownloadSession đang chạy, mỗi torrent (magnet link) một session.
+
+    Sessions post events (piece verified/failed, peer connected/dropped,
+    tracker refresh, resume check) with post(); this thread handles each one
+    as soon as it is queued by calling the session's on_<event> handler,
+    instead of polling. Freed-up work goes to the session's existing
+    connections and peer pool rather than new per-piece connections.
+    """
+
     def __init__(self, node):
         threading.Thread.__init__(self)
+        self.daemon = True
         self.node = node
-        self.downloads = {}  # {magnet_link: download_info}
+        self.downloads = {}  # {magnet_link: DownloadSession}
+        self.lock = threading.Lock()
+        self.rename_lock = threading.Lock()  # Chọn tên file cuối và đổi tên .part khi tải xong
+        self.events = queue.Queue()  # (session, event, data), None để dừng
+        node.metrics.gauge("p2p_event_queue_depth", "Sự kiện download đang chờ xử lý",
+                           collect=self.events.qsize)
+        node.metrics.gauge("p2p_downloads_active", "Số download đang chạy",
+                           collect=lambda: len(self.sessions()))
+        node.metrics.gauge("p2p_download_pieces", "Số piece đã có của từng download", ("torrent",),
+                           collect=lambda: {(session.name,): session.progress()[0] for session in self.sessions()})
+        self.event_seconds = node.metrics.histogram("p2p_event_seconds", "Thời gian xử lý một sự kiện download",
+                                                    ("event",))
     
     def run(self):
-        while self.node.running: 
-            # Kiểm tra các file đang tải
-            for magnet_link, download_info in list(self.downloads.items()):
-                if all(download_info['pieces']):
-                    self.finish_download(magnet_link, download_info)
-                else:
-                    self.request_next_piece(magnet_link, download_info)
-            
-            # Đợi một khoảng thời gian trước khi kiểm tra lại
-            threading.Event().wait(5)
+        while self.node.running:
+            item = self.events.get()
+            if item is None:
+                break
+            session, event, data = item
+            # Session đã xong hoặc đã dừng thì bỏ qua sự kiện còn lại
+            if session.finished.is_set() or self.get(session.magnet_link) is not session:
+                continue
+            try:
+                with self.event_seconds.time(event=event):
+                    getattr(session, f"on_{event}")(**data)
+            except Exception as e:
+                logger.exception("Lỗi khi xử lý sự kiện %s của %s: %s", event, session.name, e)
 
-    def finish_download(self, magnet_link, download_info):
-        """Hoàn thành quá trình tải"""
-        try:
-            # Ghép các piece thành file hoàn chỉnh
-            self.combine_pieces(magnet_link, download_info)
-            print(f"Đã tải xong file: {download_info['file_name']}")
-            
-            # Ngắt tất cả các kết nối đang hoạt động cho download này
-            for conn in download_info['connections']:
-                try:
-                    conn.cleanup()
-                except Exception as e:
-                    print(f"Lỗi khi ngắt kết nối: {e}")
-            download_info['connections'].clear()
-            
-            # Ngắt kết nối với tất cả peer từ node
-            self.node.disconnect_all_peers()         
-            
-        except Exception as e:
-            print(f"Lỗi khi hoàn thành tải file: {e}")
-        finally:
-            # Xóa thông tin download
-            if magnet_link in self.downloads:
-                del self.downloads[magnet_link]
-                if all(download_info['pieces']):
-                    self.node.start_listening()
-                # Yêu cầu lại piece không hợp lệ
-
-    def piece_completed(self, magnet_link, piece_index):
-        """Xử lý khi một piece được tải xong"""
-        download_info = self.downloads.get(magnet_link)
-        if download_info:
-            # Cập nhật trạng thái
-            download_info['active_pieces'].remove(piece_index)
-            download_info['completed_pieces'].add(piece_index)
-            
-            # Kiểm tra nếu tải xong
-            if len(download_info['completed_pieces']) == len(download_info['peers_data']['pieces']):
-                self.finish_download(magnet_link, download_info)
-            else:
-                # Tiếp tục tải các piece khác
-                download_info = self.downloads[magnet_link]
-                pieces_info = download_info['peers_data']['pieces']
-                
-                # Chọn các cặp piece-peer 
-                selected_pairs = [(piece['piece_index'], piece['nodes'][0]) for piece in pieces_info if piece['nodes']]
-                
-                for piece_index, peer in selected_pairs:
-                    if piece_index not in download_info['active_pieces']:
-                        # Tạo kết nối mới và yêu cầu piece
-                        peer_conn = self.node.connect_and_request_piece(peer, piece_index)
-                        if peer_conn:
-                            download_info['connections'].add(peer_conn)
-                            download_info['active_pieces'].add(piece_index)
-                            download_info['piece_sources'][piece_index] = peer
+    def post(self, session, event, data=None):
+        """Đưa sự kiện của session vào hàng đợi (gọi được từ thread bất kỳ)"""
+        self.events.put((session, event, data or {}))
+
+    def start_download(self, magnet_link, peers_data):
+        """Tạo session cho torrent và bắt đầu tải, trả về session (hoặc session đang chạy)"""
+        metadata = self.node.get_metadata(magnet_link)
+        if not metadata:
+            logger.warning("Không có thông tin torrent cho magnet link: %s", magnet_link)
+            return None
+        with self.lock:
+            session = self.downloads.get(magnet_link)
+            if session:
+                logger.info("File %s đang được tải", session.name)
+                return session
+            session = DownloadSession(self.node, magnet_link, metadata)
+            self.downloads[magnet_link] = session
+        session.start(peers_data)
+        return session
+
+    def get(self, magnet_link):
+        with self.lock:
+            return self.downloads.get(magnet_link)
+
+    def sessions(self):
+        with self.lock:
+            return list(self.downloads.values())
+
+    def download_finished(self, session):
+        with self.lock:
+            if self.downloads.get(session.magnet_link) is session:
+                del self.downloads[session.magnet_link]
+
+    def stop_all(self):
+        for session in self.sessions():
+            session.stop()
+        self.events.put(None)
 
 class Node:
-    def __init__(self):
+    def __init__(self, port=node_port, data_dir=node_data_dir, tracker=tracker_host, ip=None,
+                 peer_engine=peer_engine):
+        """Các tham số cho phép chạy nhiều node trên một máy (ví dụ benchmark.py)"""
+        setup_logging()  # Không làm gì nếu ứng dụng (GUI) đã cấu hình logging
         self.running = True
-        self.ip = self.get_ip()
-        self.port = 52229
+        self.ip = ip or self.get_ip()
+        self.port = port
         self.peers = []
-        self.tracker_url = f"{tracker_host}/api/nodes"
-        self.file_share_url = f"{tracker_host}/api/files"
+        self.tracker_url = f"{tracker}/api/nodes"
+        self.file_share_url = f"{tracker}/api/files"
+        self.metrics = MetricsRegistry()  # Metric của node, xem qua /metrics hoặc metrics.snapshot()
+        self.metrics_server = None
+        self.tracker = TrackerClient(tracker, metrics=self.metrics)
+        self.announcer = PieceAnnouncer(self)  # Thông báo piece mới cho tracker trong lúc tải
+        self.discovery = PeerDiscovery(self)  # Lấy và làm mới danh sách peer từ tracker
         self.download_manager = DownloadManager(self)
+        # Giới hạn băng thông cho mọi kết nối peer, đổi được lúc chạy
+        self.rate_limiter = RateLimiter(max_upload_rate, max_download_rate, peer_upload_rate, peer_download_rate)
         self.piece_length = 512 * 1024  # 512KB
-        self.node_data_dir = "node_data"
+        self.node_data_dir = data_dir
         self.torrent_dir = os.path.join(self.node_data_dir, "torrents")
-        self.pieces_dir = os.path.join(self.node_data_dir, "pieces")
         self.downloads_dir = os.path.join(self.node_data_dir, 'downloads')
+        self.resume_dir = os.path.join(self.node_data_dir, 'resume')
         os.makedirs(self.node_data_dir, exist_ok=True)
         os.makedirs(self.torrent_dir, exist_ok=True)
-        os.makedirs(self.pieces_dir, exist_ok=True)
         os.makedirs(self.downloads_dir, exist_ok=True)
-        self.current_magnet_link = None
-        self.current_file_name = None 
+        os.makedirs(self.resume_dir, exist_ok=True)
         self.shared_files = {}  # Lưu mapping giữa magnet link và thông tin file
         self.shared_files_path = os.path.join(self.node_data_dir, 'shared_files.json')
         self.load_shared_files()  # Load thông tin shared files khi khởi động
-        self.peer_connections = []  # Thêm khởi tạo peer_connections
+        self.metadata_cache = {}  # {info_hash: TorrentMetadata}
+        self.metadata_lock = threading.Lock()
+        self.storages = {}  # {info_hash: FileStorage/MultiFileStorage} file đang seed, mở một lần
+        self.storage_lock = threading.Lock()
+        self.listener = None
+        self.engine = AsyncPeerEngine(self) if peer_engine == "asyncio" else None
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Metric tính lúc đọc từ trạng thái sẵn có (tốc độ peer, số kết nối)"""
+        def peer_rates():
+            return {
+                (direction, f"{peer[0]}:{peer[1]}"): rate
+                for direction, rates in self.rate_limiter.rates().items()
+                for peer, rate in rates['peers'].items()
+            }
+
+        def connections():
+            leechers = sum(1 for session in self.download_manager.sessions()
+                           for conn in list(session.connections) if conn.running)
+            if self.engine:
+                seeders = sum(1 for conn in list(self.engine.connections) if not conn.is_initiator)
+            else:
+                seeders = self.listener.active_uploads if self.listener else 0
+            return {("Leecher",): leechers, ("Seeder",): seeders}
+
+        self.metrics.gauge("p2p_peer_rate_bytes", "Tốc độ hiện tại của từng peer (bytes/s)",
+                           ("direction", "peer"), collect=peer_rates)
+        self.metrics.gauge("p2p_peer_connections", "Số kết nối peer đang mở", ("role",), collect=connections)
+        self.read_seconds = self.metrics.histogram("p2p_piece_read_seconds",
+                                                   "Thời gian đọc piece/block từ đĩa để gửi")
+
+    def start_metrics_server(self, port=metrics_port):
+        """Mở /metrics trên localhost (một lần), bỏ qua nếu đã tắt hoặc cổng đang bận"""
+        if port is None or self.metrics_server:
+            return
+        try:
+            self.metrics_server = MetricsServer(self.metrics, port)
+        except OSError as e:
+            logger.warning("Không mở được cổng metrics %s: %s", port, e)
+            return
+        self.metrics_server.start()
 
     def stop(self):
         self.running = False
+        if self.announcer.is_alive():
+            self.announcer.stop()
+        self.discovery.stop()
+        # Announcer đã gửi nốt các piece còn lại, đóng các kết nối HTTP tới tracker
+        self.tracker.close()
+        # Dừng các download, bitfield được lưu lần cuối để tiếp tục sau
+        self.download_manager.stop_all()
+        if self.listener:
+            self.listener.stop()
+        if self.engine:
+            self.engine.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
 
     def get_ip(self):
         try:
@@ -324,10 +419,12 @@ class Node:
             return "127.0.0.1"
 
     def run(self):
+        self.start_metrics_server()
+
         # Thông báo lần đầu đến tracker
         initial_response = self.announce_to_tracker()
         if initial_response:
-            print(f"Thông tin node: {initial_response}")
+            logger.info("Thông tin node: %s", initial_response)
 
         # Bắt đầu thread để thông báo định kỳ
         announce_thread = threading.Thread(target=self.periodic_announce)
@@ -335,18 +432,15 @@ class Node:
         announce_thread.start()
 
         # Các chức năng khác của node
-        self.download_manager.start()
+        if not self.download_manager.is_alive():
+            self.download_manager.start()
 
     def announce_to_tracker(self):
-        data = {
-            "ip": self.ip,
-            "port": self.port
-        }
         try:
-            response = requests.post(self.tracker_url, json=data, timeout=10)
+            response = self.tracker.announce_node(self.ip, self.port)
             return response.json() if response.status_code == 200 else None
         except Exception as e:
-            print(f"Lỗi kết nối đến tracker: {e}")
+            logger.warning("Lỗi kết nối đến tracker: %s", e)
             return None
 
     def periodic_announce(self):
@@ -355,7 +449,7 @@ class Node:
             time.sleep(300)  # Đợi 5 phút
 
     def share_file(self, file_path, callback=None):
-        """Chia sẻ file với mạng ngang hàng"""
+        """Chia sẻ file (hoặc cả thư mục, thành một torrent nhiều file) với mạng ngang hàng"""
         try:
             # Tạo và chạy thread xử lý chia sẻ file
             share_thread = threading.Thread(
@@ -365,45 +459,57 @@ class Node:
             share_thread.start()
             return True
         except Exception as e:
-            print(f"Lỗi khi khởi tạo chia sẻ file: {e}")
+            logger.error("Lỗi khi khởi tạo chia sẻ file: %s", e)
             return False
 
     def _share_file_thread(self, file_path, callback):
         try:
             # Đọc file và tính toán pieces
-            file_name = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
+            file_name = os.path.basename(os.path.normpath(file_path))
+            if os.path.isdir(file_path):
+                # Thư mục: một torrent, các file nối liền thành một luồng byte
+                files = list_files(file_path)
+                if not files:
+                    raise ValueError(f"Thư mục {file_path} không có file nào")
+                paths = [os.path.join(file_path, *components) for components, _ in files]
+                file_size = sum(length for _, length in files)
+            else:
+                files = None
+                paths = [file_path]
+                file_size = os.path.getsize(file_path)
             total_pieces = math.ceil(file_size / self.piece_length)
-            pieces = b''
-            
-            with open(file_path, 'rb') as f:
-                for i in range(total_pieces):
-                    piece_data = f.read(self.piece_length)
-                    piece_hash = hashlib.sha1(piece_data).digest()
-                    pieces += piece_hash
-                    
-                    # Lưu piece
-                    piece_dir = os.path.join(self.pieces_dir, file_name)
-                    os.makedirs(piece_dir, exist_ok=True)
-                    piece_path = os.path.join(piece_dir, f"piece_{i}")
-                    with open(piece_path, 'wb') as piece_file:
-                        piece_file.write(piece_data)
-                    
-                    if callback:
-                        callback(i + 1, total_pieces)
+
+            # Tính hash song song, khi seed piece được đọc thẳng từ file gốc
+            use_block_hashes = merkle_block_hashes and self.piece_length % block_size == 0
+            pieces, block_hashes = hash_files(
+                paths, self.piece_length, callback, workers=hash_workers,
+                block_size=block_size if use_block_hashes else None
+            )
 
             # Tạo thông tin torrent
             info = {
                 b'name': file_name.encode(),
                 b'piece length': self.piece_length,
-                b'pieces': pieces,
-                b'length': file_size
+                b'pieces': pieces
             }
+            if files:
+                info[b'files'] = [
+                    {b'length': length, b'path': [component.encode() for component in components]}
+                    for components, length in files
+                ]
+            else:
+                info[b'length'] = file_size
+            if use_block_hashes:
+                # Gốc Merkle nằm trong info (thuộc info hash), các lá nằm ngoài info
+                info[b'block size'] = block_size
+                info[b'piece roots'] = piece_roots(block_hashes, self.piece_length // block_size)
             
             torrent = {
                 b'info': info,
                 b'announce': self.tracker_url.encode()
             }
+            if use_block_hashes:
+                torrent[b'piece layers'] = block_hashes
             
             # Tạo và lưu file torrent
             torrent_file_name = f"{file_name}.torrent"
@@ -413,8 +519,9 @@ class Node:
                 f.write(bencodepy.encode(torrent))
                 
             # Tạo magnet link
-            info_hash = hashlib.sha1(bencodepy.encode(info)).hexdigest()
-            magnet_link = f"magnet:?xt=urn:btih:{info_hash}&dn={file_name}"
+            metadata = TorrentMetadata.from_torrent(torrent)
+            self.cache_metadata(metadata)
+            magnet_link = f"magnet:?xt=urn:btih:{metadata.info_hash}&dn={file_name}"
             
             # Lưu thông tin vào shared_files
             decoded_json_path = os.path.join(self.torrent_dir, f"{file_name}_decoded.json")
@@ -430,319 +537,151 @@ class Node:
             
             # Gửi thông tin lên tracker
             with open(torrent_path, 'rb') as torrent_file:
-                files = {'torrent_file': torrent_file}
-                data = {
-                    'magnet_text': magnet_link,
-                    'name': file_name,
-                    'ip': self.ip,
-                    'port': str(self.port)
-                }
-                response = requests.post(self.file_share_url, files=files, data=data)
+                response = self.tracker.share_file(torrent_file, magnet_link, file_name, self.ip, self.port)
             
             if response.status_code == 200:
-                print(f"File {file_name} đã được chia sẻ thành công")
-                print(f"Tổng số piece: {total_pieces}")
+                logger.info("File %s đã được chia sẻ thành công", file_name)
+                logger.info("Tổng số piece: %s", total_pieces)
             else:
-                print(f"Lỗi khi chia sẻ file: {response.status_code}")
+                logger.error("Lỗi khi chia sẻ file: %s", response.status_code)
             
             if callback:
                 callback(total_pieces, total_pieces, magnet_link, torrent_path)
                 
         except Exception as e:
-            print(f"Lỗi khi chia sẻ file: {str(e)}")
-            traceback.print_exc()
+            logger.exception("Lỗi khi chia sẻ file: %s", e)
             if callback:
                 callback(0, 0, None, None)
 
-    def get_peers_for_file(self, magnet_link):
-        data = {
-            "magnet_text": magnet_link
-        }
-        try:
-            url = f"{self.file_share_url}/peers" 
-            response = requests.post(url, json=data)
-            if response.status_code == 200:
-                data = response.json()
-                print(f"API Response: {data}")  # Debug log
-                
-                # Giải mã và lưu file torrent
-                if 'torrentFile' in data:
-                    torrent_data = base64.b64decode(data['torrentFile'])
-                    
-                    # Lưu file torrent gốc
-                    torrent_file_name = f"{data['name']}.torrent"
-                    torrent_path = os.path.join(self.torrent_dir, torrent_file_name)
-                    with open(torrent_path, 'wb') as f:
-                        f.write(torrent_data)
-                    print(f"Đã lưu file torrent: {torrent_path}")
-
-                    # Giải mã torrent và lưu JSON
-                    decoded_torrent = bencodepy.decode(torrent_data)
-                    info = decoded_torrent[b'info']
-                    pieces = info[b'pieces']
-                    piece_hashes = [pieces[i:i+20].hex() for i in range(0, len(pieces), 20)]
-                    
-                    decoded_info = {
-                        'name': info[b'name'].decode('utf-8'),
-                        'piece length': info[b'piece length'],
-                        'pieces': piece_hashes,
-                        'length': info[b'length']
-                    }
-                    
-                    # Lưu file decoded JSON
-                    decoded_json_path = os.path.join(self.torrent_dir, f"{data['name']}_decoded.json")
-                    with open(decoded_json_path, 'w', encoding='utf-8') as f:
-                        json.dump(decoded_info, f, indent=2)
-                    print(f"Đã lưu file decoded JSON: {decoded_json_path}")
-
-                return {
-                    'name': data['name'],
-                    'pieces': data.get('pieces', []),
-                    'decoded_torrent': decoded_info
-                }
-        except Exception as e:
-            print(f"Lỗi khi lấy thông tin peers: {e}")
-            print(traceback.format_exc())
-        return None
-
     def start_listening(self):
-        listener = PeerConnection(self, ('0.0.0.0', self.port), is_initiator=False)
-        listener.start()
-
-    def connect_and_request_pieces(self, peers_data):
-        """Tạo nhiều kết nối và phân phối pieces"""
-        needed_pieces = self.get_needed_pieces()
-        if not needed_pieces:
+        """Khởi động listener seeding (chỉ một listener cho mỗi node)"""
+        if self.engine:
+            self.engine.start_listening()
             return
-
-        # Tạo mapping piece -> nodes có sẵn
-        piece_to_nodes = {}
-        for piece in peers_data['pieces']:
-            piece_index = piece['piece_index']
-            if piece_index in needed_pieces:
-                piece_to_nodes[piece_index] = piece['nodes']
-
-        # Chọn tối đa 3 node khác nhau
-        selected_nodes = set()
-        piece_assignments = {}  # {node_address: [piece_indexes]}
-        
-        for piece_index in needed_pieces:
-            if len(selected_nodes) >= 3:  # Giới hạn 3 kết nối
-                break
-                
-            available_nodes = piece_to_nodes.get(piece_index, [])
-            for node in available_nodes:
-                node_addr = (node['ip'], node['port'])
-                if node_addr not in selected_nodes:
-                    selected_nodes.add(node_addr)
-                    piece_assignments[node_addr] = []
-                    break
-
-        # Phân phối pieces cho các node đã chọn
-        current_node_index = 0
-        selected_node_list = list(selected_nodes)
-        
-        for piece_index in needed_pieces:
-            if not selected_node_list:
-                break
-                
-            node_addr = selected_node_list[current_node_index]
-            piece_assignments[node_addr].append(piece_index)
-            current_node_index = (current_node_index + 1) % len(selected_node_list)
-
-        # Tạo và khởi động các connection
-        for node_addr, assigned_pieces in piece_assignments.items():
-            peer_conn = PeerConnection(
-                self,
-                node_addr,
-                assigned_pieces=assigned_pieces,
-                is_initiator=True
-            )
-            self.peer_connections.append(peer_conn)
-            peer_conn.start()
-
-    def get_torrent_info(self, magnet_link):
-        """Lấy thông tin torrent từ magnet link"""
+        if self.listener and self.listener.is_alive():
+            return
+        self.listener = PeerListener(self)
+        self.listener.start()
+
+    def start_download(self, magnet_link, peers_data):
+        """Bắt đầu tải một torrent, có thể chạy song song với các download khác"""
+        # Phục vụ piece đã có ngay trong lúc tải
+        self.start_listening()
+        if not self.announcer.is_alive():
+            self.announcer.start()
+        if not self.download_manager.is_alive():
+            self.download_manager.start()
+        return self.download_manager.start_download(magnet_link, peers_data)
+
+    def open_peer_connection(self, node_addr, session):
+        """Mở kết nối leecher cho session bằng engine đang cấu hình"""
+        if self.engine:
+            return self.engine.connect(node_addr, session)
+        peer_conn = PeerConnection(
+            self,
+            node_addr,
+            session=session,
+            is_initiator=True
+        )
+        peer_conn.start()
+        return peer_conn
+
+    def cache_metadata(self, metadata):
+        """Lưu (hoặc thay) metadata trong cache khi có torrent mới được ghi"""
+        with self.metadata_lock:
+            self.metadata_cache[metadata.info_hash] = metadata
+
+    def get_metadata(self, magnet_link):
+        """Lấy TorrentMetadata theo magnet link, chỉ đọc đĩa lần đầu"""
+        if not magnet_link:
+            return None
+        key = info_hash_from_magnet(magnet_link) or magnet_link
+        with self.metadata_lock:
+            metadata = self.metadata_cache.get(key)
+        if metadata:
+            return metadata
+
+        metadata = self._load_metadata(magnet_link, key)
+        if metadata:
+            with self.metadata_lock:
+                self.metadata_cache[key] = metadata
+        return metadata
+
+    def _load_metadata(self, magnet_link, info_hash):
+        """Đọc metadata từ file torrent (hoặc decoded JSON) trên đĩa"""
         try:
-            # Kiểm tra trong shared files
             if magnet_link in self.shared_files:
                 file_info = self.shared_files[magnet_link]
+                torrent_path = file_info['torrent_path']
                 decoded_json_path = file_info['decoded_json_path']
-                
-                # Nếu file decoded JSON không tồn tại, tạo lại từ file torrent
-                if not os.path.exists(decoded_json_path):
-                    torrent_path = file_info['torrent_path']
-                    if os.path.exists(torrent_path):
-                        with open(torrent_path, 'rb') as f:
-                            torrent_data = bencodepy.decode(f.read())
-                            info = torrent_data[b'info']
-                            pieces = info[b'pieces']
-                            piece_hashes = [pieces[i:i+20].hex() for i in range(0, len(pieces), 20)]
-                            
-                            decoded_info = {
-                                'name': info[b'name'].decode('utf-8'),
-                                'piece length': info[b'piece length'],
-                                'pieces': piece_hashes,
-                                'length': info[b'length']
-                            }
-                            
-                            # Lưu file decoded JSON
-                            with open(decoded_json_path, 'w', encoding='utf-8') as f:
-                                json.dump(decoded_info, f, indent=2)
-                            return decoded_info
-                else:
-                    # Đọc từ file decoded JSON nếu tồn tại
-                    with open(decoded_json_path, 'r', encoding='utf-8') as f:
-                        return json.load(f)
-                        
-            print(f"Không tìm thấy thông tin torrent cho magnet link: {magnet_link}")
-            print(f"Danh sách shared files: {self.shared_files}")
-            return None
-        except Exception as e:
-            print(f"Lỗi khi lấy thông tin torrent: {str(e)}")
-            print(traceback.format_exc())
-            return None
+            else:
+                logger.warning("Không tìm thấy thông tin torrent cho magnet link: %s", magnet_link)
+                return None
 
-    def get_piece_data(self, magnet_link, piece_index):
-        """Lấy dữ liệu của piece từ file đã được chia sẻ"""
-        try:
-            file_info = self.get_torrent_info(magnet_link)
-            if file_info:
-                file_name = file_info['name']
-                piece_path = os.path.join(self.pieces_dir, file_name, f"piece_{piece_index}")
-                if os.path.exists(piece_path):
-                    with open(piece_path, 'rb') as f:
-                        piece_data = f.read()
-                        print(f"Đọc piece {piece_index}, kích thước: {len(piece_data)} bytes")
-                        return piece_data
-                else:
-                    print(f"Không tìm thấy piece {piece_index} tại {piece_path}")
+            if os.path.exists(torrent_path):
+                return TorrentMetadata.from_torrent_file(torrent_path)
+            if os.path.exists(decoded_json_path):
+                with open(decoded_json_path, 'r', encoding='utf-8') as f:
+                    return TorrentMetadata.from_decoded_json(info_hash, json.load(f))
+            logger.error("Lỗi: Không tìm thấy file %s", torrent_path)
             return None
         except Exception as e:
-            print(f"Lỗi khi lấy dữ liệu piece: {str(e)}")
+            logger.exception("Lỗi khi đọc thông tin torrent: %s", e)
             return None
 
-    def get_piece_hash(self, piece_index):
-        # Lấy hash của piece từ file torrent đã giải mã
-        torrent_info = self.get_decoded_torrent_info()
-        if torrent_info and 'pieces' in torrent_info:
-            return torrent_info['pieces'][piece_index]
-        return None
+    def get_storage(self, magnet_link):
+        """FileStorage của file đã chia sẻ (file gốc, file đã tải xong hoặc file đang tải)"""
+        metadata = self.get_metadata(magnet_link)
+        if not metadata:
+            return None
+        session = self.download_manager.get(magnet_link)
+        if magnet_link not in self.shared_files and session:
+            return session.get_storage()
+        with self.storage_lock:
+            storage = self.storages.get(metadata.info_hash)
+            if storage is None:
+                file_info = self.shared_files.get(magnet_link)
+                if not file_info:
+                    logger.warning("Không có file nào đang chia sẻ cho magnet link: %s", magnet_link)
+                    return None
+                storage = open_storage(file_info['file_path'], metadata)
+                self.storages[metadata.info_hash] = storage
+        return storage
+
+    def has_piece(self, magnet_link, piece_index):
+        """Node có piece để phục vụ không (file đầy đủ hoặc piece đã có trong bitfield)"""
+        if magnet_link in self.shared_files:
+            return True
+        session = self.download_manager.get(magnet_link)
+        return bool(session) and session.has_piece(piece_index)
 
-    def get_decoded_torrent_info(self):
+    def get_piece_region(self, magnet_link, piece_index, offset=0, length=None):
+        """FileRegion của piece/block để gửi zero-copy bằng sendfile"""
         try:
-            decoded_path = os.path.join(self.torrent_dir, f"{self.current_file_name}_decoded.json")
-            if os.path.exists(decoded_path):
-                with open(decoded_path, 'r') as f:
-                    torrent_info = json.load(f)
-                    if 'pieces' not in torrent_info:
-                        print("Lỗi: Không tìm thấy thông tin pieces trong file torrent đã giải mã")
-                        return None
-                    return torrent_info
-            else:
-                print(f"Lỗi: Không tìm thấy file {decoded_path}")
+            if not self.has_piece(magnet_link, piece_index):
+                logger.debug("Chưa có piece %s để gửi", piece_index)
                 return None
-        except Exception as e:
-            print(f"Lỗi khi đọc thông tin torrent: {str(e)}")
+            storage = self.get_storage(magnet_link)
+            if storage:
+                return storage.region(piece_index, offset, length)
             return None
-
-    def save_piece(self, piece_index, piece_data):
-        piece_dir = os.path.join(self.pieces_dir, self.current_file_name)
-        os.makedirs(piece_dir, exist_ok=True)
-        piece_path = os.path.join(piece_dir, f"piece_{piece_index}")
-        with open(piece_path, 'wb') as f:
-            f.write(piece_data)
-        print(f"Đã lưu piece {piece_index} vào {piece_path}")
-
-    def announce_all_pieces_to_tracker(self, torrent_info):
-        """Thông báo tất cả piece cho tracker sau khi tải xong"""
-        try:
-            tracker_piece_url = f"{tracker_host}/api/pieces"
-            total_pieces = len(torrent_info['pieces'])
-            
-            for piece_index in range(total_pieces):
-                piece_data = {
-                    "magnet_text": self.current_magnet_link,
-                    "piece_index": str(piece_index),
-                    "ip": self.ip,
-                    "port": str(self.port)
-                }
-                try:
-                    response = requests.put(tracker_piece_url, json=piece_data)
-                    if response.status_code != 200:
-                        print(f"Lỗi khi thông báo piece {piece_index} cho tracker: {response.status_code}")
-                except Exception as e:
-                    print(f"Lỗi khi gửi thông báo piece {piece_index}: {e}")
-                    continue
-            print("Đã thông báo tất cả piece cho tracker")
         except Exception as e:
-            print(f"Lỗi khi thông báo pieces cho tracker: {e}")
-
-    def combine_pieces(self):
-        """Ghép các piece thành file hoàn chỉnh"""
-        piece_dir = os.path.join(self.pieces_dir, self.current_file_name)
-        output_path = os.path.join(self.downloads_dir, self.current_file_name)
-        
-        with open(output_path, 'wb') as outfile:
-            piece_index = 0
-            while True:
-                piece_path = os.path.join(piece_dir, f"piece_{piece_index}")
-                if not os.path.exists(piece_path):
-                    break
-                
-                with open(piece_path, 'rb') as piece_file:
-                    outfile.write(piece_file.read())
-                piece_index += 1
-            
-        print(f"Đã ghép file thành công: {output_path}")
-        
-        # Lưu thông tin vào shared_files
-        torrent_info = self.get_decoded_torrent_info()
-        if torrent_info and self.current_magnet_link:
-            file_info = {
-                'file_path': output_path,
-                'file_name': self.current_file_name,
-                'torrent_path': os.path.join(self.torrent_dir, f"{self.current_file_name}.torrent"),
-                'decoded_json_path': os.path.join(self.torrent_dir, f"{self.current_file_name}_decoded.json"),
-                'magnet_link': self.current_magnet_link
-            }
-            self.shared_files[self.current_magnet_link] = file_info
-            self.save_shared_files()
-            
-            # Thông báo tất cả piece cho tracker
-            self.announce_all_pieces_to_tracker(torrent_info)
+            logger.error("Lỗi khi lấy dữ liệu piece: %s", e)
+            return None
 
-    def handle_received_piece(self, piece_index, piece_data):
-        """Xử lý piece nhận được từ peer"""
-        piece_hash = self.get_piece_hash(piece_index)
-        received_hash = hashlib.sha1(piece_data).hexdigest()
-        
-        if piece_hash == received_hash:
-            self.save_piece(piece_index, piece_data)
-            self.download_manager.piece_completed(self.current_magnet_link, piece_index)
-            
-            # Kiểm tra nếu đã tải xong
-            self.finish_download()
-        else:
-            print(f"Piece {piece_index} không hợp lệ")
-            self.download_manager.piece_failed(self.current_magnet_link, piece_index)
-
-    def get_needed_pieces(self):
-        """Lấy danh sách các piece còn thiếu"""
-        piece_dir = os.path.join(self.pieces_dir, self.current_file_name)
-        if not os.path.exists(piece_dir):
-            os.makedirs(piece_dir)
-        
-        torrent_info = self.get_decoded_torrent_info()
-        if not torrent_info:
-            print("Không thể lấy thông tin torrent đã giải mã")
-            return []
-        
-        total_pieces = len(torrent_info['pieces'])
-        existing_pieces = set(int(f.split('_')[1]) for f in os.listdir(piece_dir) 
-                         if f.startswith('piece_'))
-    
-        return [i for i in range(total_pieces) if i not in existing_pieces]
+    def add_downloaded_file(self, magnet_link, metadata, storage):
+        """Đăng ký file vừa tải xong vào shared_files và seed tiếp bằng storage đang mở"""
+        with self.storage_lock:
+            self.storages[metadata.info_hash] = storage
+        file_info = {
+            'file_path': storage.path,
+            'file_name': metadata.name,
+            'torrent_path': os.path.join(self.torrent_dir, f"{metadata.name}.torrent"),
+            'decoded_json_path': os.path.join(self.torrent_dir, f"{metadata.name}_decoded.json"),
+            'magnet_link': magnet_link
+        }
+        self.shared_files[magnet_link] = file_info
+        self.save_shared_files()
 
     def load_shared_files(self):
         """Load thông tin shared files từ file JSON"""
@@ -751,7 +690,7 @@ class Node:
                 with open(self.shared_files_path, 'r') as f:
                     self.shared_files = json.load(f)
         except Exception as e:
-            print(f"Lỗi khi load shared files: {e}")
+            logger.error("Lỗi khi load shared files: %s", e)
             self.shared_files = {}
 
     def save_shared_files(self):
@@ -760,47 +699,4 @@ class Node:
             with open(self.shared_files_path, 'w') as f:
                 json.dump(self.shared_files, f, indent=2)
         except Exception as e:
-            print(f"Lỗi khi lưu shared files: {e}")
-
-    def finish_download(self):
-        """Kiểm tra xem đã tải đủ các piece chưa"""
-        piece_dir = os.path.join(self.pieces_dir, self.current_file_name)
-        if not os.path.exists(piece_dir):
-            return False
-            
-        torrent_info = self.get_decoded_torrent_info()
-        total_pieces = len(torrent_info['pieces'])
-        
-        existing_pieces = [f for f in os.listdir(piece_dir) if f.startswith('piece_')]
-
-        """Xử lý khi tải file hoàn tất"""
-        if len(existing_pieces) == total_pieces:
-            try:
-                # Ghép các piece thành file hoàn chỉnh
-                self.combine_pieces()
-                
-                # Ngắt kết nối với tất cả peer
-                for peer_conn in self.peer_connections:
-                    peer_conn.cleanup()
-                    
-                
-                print(f"Đã tải xong file: {self.current_file_name}")
-                
-                # Cập nhật trạng thái
-                self.current_file_name = None
-                self.current_magnet_link = None
-                self.peer_connections = []
-                
-            except Exception as e:
-                print(f"Lỗi khi hoàn thành tải file: {e}")
-
-    def disconnect_all_peers(self):
-        """Ngắt tất cả các kết nối peer"""
-        for peer_conn in list(self.peer_connections):
-            try:
-                peer_conn.cleanup()
-                peer_conn.join(timeout=1)
-                self.peer_connections.remove(peer_conn) 
-            except Exception as e:
-                print(f"Lỗi khi ngắt kết nối: {e}")
-        self.peer_connections.clear()
\ No newline at end of file
+            logger.error("Lỗi khi lưu shared files: %s", e)
@@ -0,0 +1,298 @@
+import threading, time, random, logging, collections
+
+logger = logging.getLogger(__name__)
+
+
+class PieceScheduler:
+    """Rarest-first piece scheduler for one download.
+
+    Connections pull work with next_piece(peer): each peer only gets pieces it
+    actually holds (per the tracker's piece -> nodes map), rarest first. Because
+    work is pulled as the request window drains, faster peers take more pieces;
+    window_for() additionally scales each peer's window by measured throughput.
+
+    Once every remaining piece has been handed out, the scheduler enters
+    endgame: idle peers get duplicate requests for pieces still in flight
+    elsewhere, and piece_done() reports who else must be sent a CANCEL.
+    """
+
+    RATE_INTERVAL = 1.0  # Giây giữa hai lần lấy mẫu tốc độ
+    RATE_ALPHA = 0.3  # Hệ số EWMA cho tốc độ
+    MIN_SHARE, MAX_SHARE = 0.25, 4.0
+
+    def __init__(self, pieces_info, needed_pieces, exclude=()):
+        self.lock = threading.Lock()
+        self.exclude = set(exclude)  # Peer không bao giờ tải từ (chính node này, peer bị cấm)
+        self.needed = set(needed_pieces)
+        self.assigned = {}  # {piece_index: peer}
+        self.duplicates = collections.defaultdict(set)  # {piece_index: set(peer)} request trùng trong endgame
+        self.rejected = collections.defaultdict(set)  # {piece_index: set(peer)} peer đã gửi dữ liệu hỏng của piece
+        self.piece_nodes = {}  # {piece_index: set(peer)}
+        self.peer_queues = {}  # {peer: deque(piece_index)} sắp theo độ hiếm
+        self.rates = {}  # {peer: bytes/s (EWMA)}
+        self._samples = {}  # {peer: [bytes, start_time]}
+        self.update_sources(pieces_info)
+
+    @staticmethod
+    def peer_key(node):
+        return (node['ip'], int(node['port']))
+
+    def update_sources(self, pieces_info):
+        """Nạp (lại) bảng piece -> nodes từ tracker và sắp lại thứ tự rarest-first"""
+        with self.lock:
+            # Giữ nguồn của mọi piece, piece đã có vẫn có thể bị trả lại (add_piece)
+            for piece in pieces_info:
+                self.piece_nodes[piece['piece_index']] = {self.peer_key(node) for node in piece['nodes']} - self.exclude
+
+            # Xáo trộn trước khi sort để các peer không cùng bắt đầu từ một piece
+            order = list(self.piece_nodes)
+            random.shuffle(order)
+            order.sort(key=lambda piece_index: len(self.piece_nodes[piece_index]))
+
+            self.peer_queues = collections.defaultdict(collections.deque)
+            for piece_index in order:
+                for peer in self.piece_nodes[piece_index]:
+                    self.peer_queues[peer].append(piece_index)
+
+    def peers(self):
+        """Các peer đang giữ ít nhất một piece còn thiếu, nhiều piece nhất trước"""
+        with self.lock:
+            counts = collections.Counter(
+                peer for piece_index in self.needed
+                for peer in self.piece_nodes.get(piece_index, ())
+            )
+        return [peer for peer, _ in counts.most_common()]
+
+    def next_piece(self, peer):
+        """Piece hiếm nhất mà peer có và chưa được giao cho ai, hoặc None"""
+        with self.lock:
+            queue = self.peer_queues.get(peer)
+            while queue:
+                piece_index = queue.popleft()
+                if piece_index in self.needed and piece_index not in self.assigned:
+                    if self._rejected(piece_index, peer):
+                        continue
+                    self.assigned[piece_index] = peer
+                    return piece_index
+            return self._next_endgame_piece(peer)
+
+    def _rejected(self, piece_index, peer):
+        """Peer đã gửi dữ liệu hỏng của piece và piece còn nguồn khác"""
+        rejected = self.rejected.get(piece_index)
+        return bool(rejected) and peer in rejected and bool(self.piece_nodes.get(piece_index, set()) - rejected)
+
+    def _next_endgame_piece(self, peer):
+        """Endgame: piece đang tải ở peer khác mà peer này cũng có, ít request trùng nhất"""
+        if len(self.assigned) < len(self.needed):
+            return None
+        candidates = [
+            piece_index for piece_index, owner in self.assigned.items()
+            if owner != peer
+            and peer not in self.duplicates[piece_index]
+            and peer in self.piece_nodes.get(piece_index, ())
+            and not self._rejected(piece_index, peer)
+        ]
+        if not candidates:
+            return None
+        piece_index = min(candidates, key=lambda index: len(self.duplicates[index]))
+        self.duplicates[piece_index].add(peer)
+        return piece_index
+
+    def is_needed(self, piece_index):
+        with self.lock:
+            return piece_index in self.needed
+
+    def piece_done(self, piece_index):
+        """Đánh dấu piece đã xong, trả về các peer còn đang tải piece này"""
+        with self.lock:
+            self.needed.discard(piece_index)
+            self.rejected.pop(piece_index, None)
+            peers = self.duplicates.pop(piece_index, set())
+            owner = self.assigned.pop(piece_index, None)
+            if owner:
+                peers.add(owner)
+            return peers
+
+    def piece_failed(self, piece_index, peers=()):
+        """Trả piece về hàng đợi để tải lại (ưu tiên đầu hàng), tránh các peer đã gửi dữ liệu hỏng"""
+        with self.lock:
+            if peers:
+                self.rejected[piece_index].update(peers)
+            self.assigned.pop(piece_index, None)
+            self.duplicates.pop(piece_index, None)
+            self._requeue(piece_index)
+
+    def add_piece(self, piece_index):
+        """Thêm lại piece tưởng đã có (ví dụ hỏng khi kiểm tra lại lúc resume)"""
+        with self.lock:
+            if piece_index not in self.needed:
+                self.needed.add(piece_index)
+                self._requeue(piece_index)
+
+    def release_peer(self, peer):
+        """Trả lại các piece chưa xong của peer (peer ngắt kết nối hoặc bị loại)"""
+        with self.lock:
+            released = [piece_index for piece_index, owner in self.assigned.items() if owner == peer]
+            for piece_index in released:
+                del self.assigned[piece_index]
+                # Peer trùng trong endgame (nếu có) tiếp quản piece
+                duplicates = self.duplicates.get(piece_index)
+                if duplicates:
+                    self.assigned[piece_index] = duplicates.pop()
+                else:
+                    self._requeue(piece_index)
+            for duplicates in self.duplicates.values():
+                duplicates.discard(peer)
+            self.rates.pop(peer, None)
+            self._samples.pop(peer, None)
+        return released
+
+    def ban_peer(self, peer):
+        """Không giao piece cho peer nữa, kể cả khi tracker vẫn báo peer có piece"""
+        with self.lock:
+            self.exclude.add(peer)
+            for peers in self.piece_nodes.values():
+                peers.discard(peer)
+            self.peer_queues.pop(peer, None)
+
+    def _requeue(self, piece_index):
+        if piece_index not in self.needed:
+            return
+        for peer in self.piece_nodes.get(piece_index, ()):
+            if peer in self.peer_queues:
+                self.peer_queues[peer].appendleft(piece_index)
+
+    def is_complete(self):
+        with self.lock:
+            return not self.needed
+
+    def record_transfer(self, peer, nbytes):
+        """Cộng dồn byte nhận từ peer, cập nhật tốc độ mỗi RATE_INTERVAL giây"""
+        now = time.monotonic()
+        with self.lock:
+            sample = self._samples.setdefault(peer, [0, now])
+            sample[0] += nbytes
+            elapsed = now - sample[1]
+            if elapsed >= self.RATE_INTERVAL:
+                rate = sample[0] / elapsed
+                previous = self.rates.get(peer)
+                self.rates[peer] = rate if previous is None else (
+                    self.RATE_ALPHA * rate + (1 - self.RATE_ALPHA) * previous)
+                self._samples[peer] = [0, now]
+
+    def rate(self, peer):
+        """Tốc độ hiện tại của peer (bytes/s), None nếu chưa nhận byte nào.
+
+        A peer that has stalled mid-interval is folded in so its rate decays
+        instead of staying at the last good sample.
+        """
+        now = time.monotonic()
+        with self.lock:
+            rate = self.rates.get(peer)
+            sample = self._samples.get(peer)
+            if sample:
+                elapsed = now - sample[1]
+                if rate is None:
+                    rate = sample[0] / elapsed if elapsed > 0 else None
+                elif elapsed >= 2 * self.RATE_INTERVAL:
+                    rate = self.RATE_ALPHA * (sample[0] / elapsed) + (1 - self.RATE_ALPHA) * rate
+            return rate
+
+    def window_for(self, peer, base_window):
+        """Cửa sổ request của peer, tỉ lệ với tốc độ so với trung bình các peer"""
+        with self.lock:
+            rate = self.rates.get(peer)
+            if rate is None or not self.rates:
+                return base_window
+            average = sum(self.rates.values()) / len(self.rates)
+        if average <= 0:
+            return base_window
+        share = min(self.MAX_SHARE, max(self.MIN_SHARE, rate / average))
+        return max(1, round(base_window * share))
+
+
+class PeerPool(threading.Thread):
+    """Quản lý tập kết nối của một download.
+
+    Keeps up to max_connections peers connected, opens new connections as the
+    tracker reports more sources, and drops peers whose throughput stays below
+    min_rate while they have requests outstanding. Their pieces go back to the
+    scheduler and are picked up by the remaining connections.
+    """
+
+    CHECK_INTERVAL = 2
+    COOLDOWN = 30  # Giây trước khi thử lại peer bị loại hoặc lỗi kết nối
+
+    def __init__(self, session, max_connections, min_rate, grace):
+        super().__init__()
+        self.daemon = True
+        self.session = session
+        self.scheduler = session.scheduler
+        self.max_connections = max_connections
+        self.min_rate = min_rate
+        self.grace = grace
+        self.connections = {}  # {peer: (conn, connected_at)}
+        self.cooldown = {}  # {peer: thời điểm được thử lại}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self):
+        self.fill()
+        # Chạy đến khi Node dừng pool: piece có thể được thêm lại sau khi đã đủ
+        while not self.stopped.wait(self.CHECK_INTERVAL):
+            if self.scheduler.is_complete():
+                continue
+            self.drop_slow_peers()
+            self.fill()
+            if not self.active_peers():
+                # Không còn peer nào để tải: xin tracker danh sách mới
+                self.session.request_fresh_sources()
+            # Kết nối rảnh lấy thêm việc (ví dụ request trùng khi vào endgame)
+            self.session.refill_connections()
+
+    def update_sources(self, pieces_info):
+        """Nạp danh sách nguồn mới từ tracker và mở thêm kết nối nếu còn slot"""
+        self.scheduler.update_sources(pieces_info)
+        self.fill()
+        self.session.refill_connections()
+
+    def fill(self):
+        """Mở kết nối tới các peer chưa kết nối cho đến khi đủ max_connections"""
+        now = time.monotonic()
+        with self.lock:
+            self._remove_closed(now)
+            for peer in self.scheduler.peers():
+                if len(self.connections) >= self.max_connections:
+                    break
+                if peer in self.connections or self.cooldown.get(peer, 0) > now:
+                    continue
+                conn = self.session.open_peer_connection(peer)
+                self.connections[peer] = (conn, now)
+
+    def _remove_closed(self, now):
+        for peer, (conn, _) in list(self.connections.items()):
+            if not conn.running:
+                del self.connections[peer]
+                self.cooldown[peer] = now + self.COOLDOWN
+
+    def drop_slow_peers(self):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.connections) < 2:
+                return  # Không loại nguồn duy nhất
+            for peer, (conn, connected_at) in list(self.connections.items()):
+                if now - connected_at < self.grace or not conn.in_flight:
+                    continue
+                rate = self.scheduler.rate(peer) or 0
+                if rate < self.min_rate:
+                    logger.info("Loại peer chậm %s:%s (%.1f KB/s)", peer[0], peer[1], rate / 1024)
+                    del self.connections[peer]
+                    self.cooldown[peer] = now + self.COOLDOWN
+                    conn.cleanup()
+
+    def active_peers(self):
+        with self.lock:
+            return [peer for peer, (conn, _) in self.connections.items() if conn.running]
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,413 @@
+import json, struct, base64, logging, threading, collections
+from config import request_window, block_request_window
+from storage import FileRegion
+from session import PEER_CONNECTED, PEER_DROPPED
+from ratelimit import UPLOAD, DOWNLOAD
+from log import MESSAGE_LOGGER
+
+logger = logging.getLogger(__name__)
+message_logger = logging.getLogger(MESSAGE_LOGGER)
+
+# Phiên bản giao thức peer, gửi trong HELLO để hai bên thống nhất tính năng
+PROTOCOL_VERSION = 2
+
+# Các tính năng tùy chọn được thương lượng trong HELLO / HELLO_ACK
+FEATURE_BINARY = "binary"
+FEATURE_BLOCKS = "blocks"
+FEATURE_CANCEL = "cancel"
+SUPPORTED_FEATURES = [FEATURE_BINARY, FEATURE_BLOCKS, FEATURE_CANCEL]
+
+REQUEST_TYPES = ("REQUEST_PIECE", "REQUEST_BLOCK")
+DATA_TYPES = ("PIECE_DATA", "BLOCK_DATA")
+
+# Seeder từ chối các request block lớn hơn giới hạn này
+MAX_BLOCK_SIZE = 128 * 1024
+
+# Handshake luôn gửi dạng JSON line để peer cũ vẫn hiểu được
+HANDSHAKE_TYPES = ("HELLO", "HELLO_ACK")
+
+MESSAGE_END = b"\n"
+
+# Binary frame: version, message type, piece index, meta length, payload length.
+# Meta is a JSON object with the remaining fields, payload is the raw piece bytes.
+FRAME_HEADER = struct.Struct("!BBIII")
+FRAME_VERSION = 1
+NO_PIECE_INDEX = 0xFFFFFFFF
+
+MESSAGE_TYPES = {
+    "HELLO": 1,
+    "HELLO_ACK": 2,
+    "REQUEST_PIECE": 3,
+    "PIECE_DATA": 4,
+    "REQUEST_BLOCK": 5,
+    "BLOCK_DATA": 6,
+    "CANCEL": 7
+}
+MESSAGE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+
+
+def negotiate_features(offered):
+    """Return the features both sides support, in our order of preference"""
+    return [feature for feature in SUPPORTED_FEATURES if feature in (offered or [])]
+
+
+def encode_json(message):
+    """Encode a message dict as a newline-terminated JSON line (legacy format)"""
+    if 'data' in message:
+        message = dict(message, data=base64.b64encode(message['data']).decode())
+    return json.dumps(message).encode('utf-8') + MESSAGE_END
+
+
+def decode_json(line):
+    message = json.loads(line)
+    if 'data' in message:
+        message['data'] = base64.b64decode(message['data'])
+    return message
+
+
+def encode_frame(message):
+    """Encode a message dict as a binary frame.
+
+    Returns (header, payload) so the caller can send the payload without
+    concatenating it onto the header first.
+    """
+    meta = {k: v for k, v in message.items() if k not in ('type', 'piece_index', 'data')}
+    meta_bytes = json.dumps(meta).encode('utf-8') if meta else b''
+    payload = message.get('data') or b''
+    piece_index = message.get('piece_index')
+    header = FRAME_HEADER.pack(
+        FRAME_VERSION,
+        MESSAGE_TYPES[message['type']],
+        NO_PIECE_INDEX if piece_index is None else piece_index,
+        len(meta_bytes),
+        len(payload)
+    )
+    return header + meta_bytes, payload
+
+
+def decode_frame(buffer):
+    """Decode one binary frame from the start of buffer.
+
+    Returns (message, consumed) or (None, 0) if the frame is not complete yet.
+    """
+    if len(buffer) < FRAME_HEADER.size:
+        return None, 0
+    version, type_code, piece_index, meta_length, payload_length = FRAME_HEADER.unpack_from(buffer)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version: {version}")
+
+    meta_start = FRAME_HEADER.size
+    payload_start = meta_start + meta_length
+    frame_end = payload_start + payload_length
+    if len(buffer) < frame_end:
+        return None, 0
+
+    message = json.loads(bytes(buffer[meta_start:payload_start])) if meta_length else {}
+    message['type'] = MESSAGE_NAMES.get(type_code)
+    if piece_index != NO_PIECE_INDEX:
+        message['piece_index'] = piece_index
+    if payload_length:
+        message['data'] = bytes(buffer[payload_start:frame_end])
+    return message, frame_end
+
+
+class PeerProtocol:
+    """Transport-independent half of a peer connection.
+
+    Parses incoming bytes, runs the HELLO / REQUEST_PIECE / PIECE_DATA
+    exchange against the Node callbacks and queues replies. Subclasses
+    provide the transport: queue_message() and the actual socket I/O.
+    """
+
+    RECV_SIZE = 64 * 1024
+
+    def _init_protocol(self, node, peer_address, session, is_initiator):
+        self.node = node
+        self.peer_address = peer_address
+        self.is_initiator = is_initiator
+        self.session = session  # DownloadSession của download (chỉ phía leecher)
+        self.scheduler = session.scheduler if session else None
+        # Torrent của kết nối cho giới hạn tốc độ; phía seeder lấy từ request
+        self.torrent = session.magnet_link if session else None
+        self.ready = False  # Đã xong handshake, được phép gửi request
+        self.request_window = request_window
+        self.block_request_window = block_request_window
+        self.pending_blocks = collections.deque()  # (piece_index, offset, length) của piece đang tách block
+        self.in_flight = set()  # piece_index hoặc (piece_index, offset) đang chờ dữ liệu
+        self.request_lock = threading.Lock()
+        self.buffer = bytearray()
+        self.use_binary = False  # Bật sau khi HELLO/HELLO_ACK thống nhất "binary"
+        self.use_blocks = False  # Bật khi cả hai bên hỗ trợ "blocks"
+        self.use_cancel = False  # Peer hiểu message CANCEL
+        self.cancelled_pieces = set()  # Phía seeder: piece bị CANCEL, bỏ qua khi gửi
+        self.role = "Leecher" if is_initiator else "Seeder"
+        metrics = node.metrics
+        self.bytes_counter = metrics.counter("p2p_bytes_total", "Bytes gửi/nhận qua kết nối peer", ("direction",))
+        self.messages_counter = metrics.counter("p2p_messages_total", "Message peer đã gửi/nhận",
+                                                ("direction", "type"))
+        self.send_seconds = metrics.histogram("p2p_message_send_seconds",
+                                              "Thời gian ghi một message vào socket", ("type",))
+        self.queue_depth = metrics.gauge("p2p_send_queue_messages", "Message đang chờ gửi", ("role",))
+
+    def queue_message(self, message_dict):
+        raise NotImplementedError
+
+    def _hello_message(self):
+        return {
+            "type": "HELLO",
+            "version": PROTOCOL_VERSION,
+            "features": SUPPORTED_FEATURES
+        }
+
+    def _encode_message(self, message_dict):
+        """Return the chunks to write for message_dict in the current wire format.
+
+        In binary mode the payload may be a FileRegion, which the transport
+        sends straight from the file; JSON mode reads it here, at send time.
+        """
+        if self.use_binary and message_dict['type'] not in HANDSHAKE_TYPES:
+            header, payload = encode_frame(message_dict)
+            return [header, payload] if payload else [header]
+        if isinstance(message_dict.get('data'), FileRegion):
+            with self.node.read_seconds.time():
+                message_dict = dict(message_dict, data=message_dict['data'].read())
+        return [encode_json(message_dict)]
+
+    def _rate_delay(self, direction, nbytes):
+        """Đếm nbytes vào metrics, trả về số giây phải chờ theo RateLimiter của node"""
+        self.bytes_counter.inc(nbytes, direction=direction)
+        return self.node.rate_limiter.delay(direction, nbytes, self.peer_address, self.torrent)
+
+    def _send_delay(self, chunks):
+        return self._rate_delay(UPLOAD, sum(len(chunk) for chunk in chunks))
+
+    def _receive_delay(self, data):
+        return self._rate_delay(DOWNLOAD, len(data))
+
+    def _message_sent(self, message_dict, seconds):
+        self.messages_counter.inc(direction="sent", type=message_dict['type'])
+        self.send_seconds.observe(seconds, type=message_dict['type'])
+
+    def _log_message(self, action, message_dict):
+        # Gọi cho mọi message: chỉ dựng bản rút gọn khi log message đang bật
+        if not message_logger.isEnabledFor(logging.DEBUG):
+            return
+        log_message = {k: '<binary data>' if k == 'data' else v
+                       for k, v in message_dict.items()}
+        message_logger.debug("%s: %s message: %s", self.role, action, log_message)
+
+    def _drain_buffer(self):
+        """Tách các message hoàn chỉnh khỏi buffer.
+
+        The wire format can switch from JSON lines to binary frames in the
+        middle of a buffer (right after the handshake), so it is re-checked
+        before every message.
+        """
+        while True:
+            if self.use_binary:
+                message_dict, consumed = decode_frame(self.buffer)
+                if message_dict is None:
+                    return
+                del self.buffer[:consumed]
+            else:
+                end = self.buffer.find(MESSAGE_END)
+                if end < 0:
+                    return
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 1]
+                if not line:
+                    continue
+                message_dict = decode_json(line)
+            self._handle_received_message(message_dict)
+
+    def _handle_received_message(self, message_dict):
+        self._log_message("Received", message_dict)
+        self.messages_counter.inc(direction="received", type=message_dict.get('type'))
+        # Request mới sau CANCEL nghĩa là peer lại cần piece này
+        if message_dict.get('type') in REQUEST_TYPES:
+            self.cancelled_pieces.discard(message_dict['piece_index'])
+        self._handle_message_type(message_dict)
+
+    def _should_send(self, message_dict):
+        """False nếu là dữ liệu của piece mà peer đã CANCEL"""
+        return not (message_dict['type'] in DATA_TYPES
+                    and message_dict['piece_index'] in self.cancelled_pieces)
+
+    def _handle_message_type(self, message):
+        handlers = {
+            "HELLO": self._handle_hello,
+            "HELLO_ACK": self._handle_hello_ack,
+            "REQUEST_PIECE": self._handle_request_piece,
+            "PIECE_DATA": self._handle_piece_data,
+            "REQUEST_BLOCK": self._handle_request_block,
+            "BLOCK_DATA": self._handle_block_data,
+            "CANCEL": self._handle_cancel
+        }
+        handler = handlers.get(message.get('type'))
+        if handler:
+            handler(message)
+
+    def _handle_hello(self, message):
+        if not self.is_initiator:
+            features = negotiate_features(message.get('features'))
+            self.queue_message({
+                "type": "HELLO_ACK",
+                "version": PROTOCOL_VERSION,
+                "features": features
+            })
+            # HELLO_ACK vẫn đi dạng JSON, các message sau đó dùng binary frame
+            self.use_binary = FEATURE_BINARY in features
+            self.use_blocks = FEATURE_BLOCKS in features
+            self.use_cancel = FEATURE_CANCEL in features
+
+    def _handle_hello_ack(self, message):
+        if self.is_initiator:
+            features = message.get('features', [])
+            self.use_binary = FEATURE_BINARY in features
+            self.use_blocks = FEATURE_BLOCKS in features
+            self.use_cancel = FEATURE_CANCEL in features
+            self.ready = True
+            self.session.post(PEER_CONNECTED, peer=self.peer_address)
+            self.request_pieces()
+
+    def _handle_request_piece(self, message):
+        if not self.is_initiator:
+            self.torrent = message['magnet_link']
+            # Chỉ đọc dữ liệu lúc gửi, hàng đợi không giữ cả piece trong bộ nhớ
+            piece_data = self.node.get_piece_region(message['magnet_link'], message['piece_index'])
+            if piece_data:
+                self.queue_message({
+                    "type": "PIECE_DATA",
+                    "piece_index": message['piece_index'],
+                    "data": piece_data
+                })
+
+    def _handle_piece_data(self, message):
+        if self.is_initiator:
+            with self.request_lock:
+                self.in_flight.discard(message['piece_index'])
+            self.scheduler.record_transfer(self.peer_address, len(message['data']))
+            self.session.handle_received_piece(
+                message['piece_index'],
+                message['data'],
+                (self.peer_address,)
+            )
+            self.fill_request_window()
+
+    def _handle_request_block(self, message):
+        if not self.is_initiator:
+            self.torrent = message['magnet_link']
+            length = message['length']
+            if length <= 0 or length > MAX_BLOCK_SIZE:
+                logger.warning("%s: Rejecting block request of %s bytes", self.role, length)
+                return
+            block_data = self.node.get_piece_region(
+                message['magnet_link'],
+                message['piece_index'],
+                message['offset'],
+                length
+            )
+            if block_data:
+                self.queue_message({
+                    "type": "BLOCK_DATA",
+                    "piece_index": message['piece_index'],
+                    "offset": message['offset'],
+                    "data": block_data
+                })
+
+    def _handle_block_data(self, message):
+        if self.is_initiator:
+            with self.request_lock:
+                self.in_flight.discard((message['piece_index'], message['offset']))
+            self.scheduler.record_transfer(self.peer_address, len(message['data']))
+            verified = self.session.handle_received_block(
+                message['piece_index'],
+                message['offset'],
+                message['data'],
+                self.peer_address
+            )
+            if not verified:
+                self.reject_piece(message['piece_index'])
+            self.fill_request_window()
+
+    def _handle_cancel(self, message):
+        if not self.is_initiator:
+            self.cancelled_pieces.add(message['piece_index'])
+
+    def cancel_piece(self, piece_index):
+        """Huỷ các request còn chờ của piece (đã nhận đủ từ peer khác)"""
+        with self.request_lock:
+            pending = [key for key in self.in_flight
+                       if key == piece_index or (isinstance(key, tuple) and key[0] == piece_index)]
+            for key in pending:
+                self.in_flight.discard(key)
+            self.pending_blocks = collections.deque(
+                block for block in self.pending_blocks if block[0] != piece_index)
+        if pending and self.use_cancel:
+            self.queue_message({"type": "CANCEL", "piece_index": piece_index})
+        self.fill_request_window()
+
+    def reject_piece(self, piece_index):
+        """Block sai hash: bỏ các block còn chờ của piece, trả piece cho scheduler để peer khác tải phần còn thiếu"""
+        with self.request_lock:
+            self.pending_blocks = collections.deque(
+                block for block in self.pending_blocks if block[0] != piece_index)
+        self.scheduler.piece_failed(piece_index, (self.peer_address,))
+
+    def request_pieces(self):
+        self.fill_request_window()
+
+    def fill_request_window(self):
+        """Lấy piece từ scheduler cho đến khi đầy cửa sổ (tính theo piece hoặc theo block)"""
+        if not (self.ready and self.scheduler):
+            return
+        requests = []
+        with self.request_lock:
+            if self.use_blocks:
+                window = self.scheduler.window_for(self.peer_address, self.block_request_window)
+                while len(self.in_flight) < window:
+                    if not self.pending_blocks:
+                        piece_index = self.scheduler.next_piece(self.peer_address)
+                        if piece_index is None:
+                            break
+                        self._split_piece(piece_index)
+                        continue
+                    piece_index, offset, length = self.pending_blocks.popleft()
+                    self.in_flight.add((piece_index, offset))
+                    requests.append({
+                        "type": "REQUEST_BLOCK",
+                        "piece_index": piece_index,
+                        "offset": offset,
+                        "length": length,
+                        "magnet_link": self.session.magnet_link
+                    })
+            else:
+                window = self.scheduler.window_for(self.peer_address, self.request_window)
+                while len(self.in_flight) < window:
+                    piece_index = self.scheduler.next_piece(self.peer_address)
+                    if piece_index is None:
+                        break
+                    self.in_flight.add(piece_index)
+                    requests.append({
+                        "type": "REQUEST_PIECE",
+                        "piece_index": piece_index,
+                        "magnet_link": self.session.magnet_link
+                    })
+        for request in requests:
+            self.queue_message(request)
+
+    def release_requests(self):
+        """Kết nối đóng: báo session để trả các piece đang tải dở cho scheduler"""
+        if not self.scheduler:
+            return
+        with self.request_lock:
+            self.ready = False
+            self.in_flight.clear()
+            self.pending_blocks.clear()
+        self.session.post(PEER_DROPPED, peer=self.peer_address)
+
+    def _split_piece(self, piece_index):
+        self.pending_blocks.extend(
+            (piece_index, offset, length)
+            for offset, length in self.session.get_missing_blocks(piece_index)
+        )
@@ -0,0 +1,135 @@
+import time, threading
+
+UPLOAD = "upload"
+DOWNLOAD = "download"
+
+
+class TokenBucket:
+    """Token bucket (bytes/s) có đo tốc độ thực tế.
+
+    reserve() always takes the bytes and returns how long the caller must
+    wait before using them; the bucket may go into debt for a message larger
+    than the burst, which simply spreads the wait over later calls. A rate of
+    None means unlimited (reserve() only measures).
+    """
+
+    MEASURE_INTERVAL = 1.0
+
+    def __init__(self, rate=None, burst=None):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = self._capacity()
+        self.updated = time.monotonic()
+        self.measured = 0.0
+        self._window_bytes = 0
+        self._window_start = self.updated
+
+    def _capacity(self):
+        if not self.rate:
+            return 0
+        # Mặc định cho phép dồn tối đa 1/4 giây dữ liệu
+        return self.burst or max(64 * 1024, self.rate / 4)
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst
+            self.tokens = min(self.tokens, self._capacity())
+
+    def reserve(self, nbytes):
+        """Lấy nbytes token, trả về số giây cần chờ (0 nếu đủ token)"""
+        now = time.monotonic()
+        with self.lock:
+            self._window_bytes += nbytes
+            elapsed = now - self._window_start
+            if elapsed >= self.MEASURE_INTERVAL:
+                self.measured = self._window_bytes / elapsed
+                self._window_bytes = 0
+                self._window_start = now
+            if not self.rate:
+                return 0
+            self.tokens = min(self._capacity(), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= nbytes
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def current_rate(self):
+        """Tốc độ đo được (bytes/s), giảm dần về 0 khi không còn dữ liệu"""
+        with self.lock:
+            elapsed = time.monotonic() - self._window_start
+            if elapsed >= 2 * self.MEASURE_INTERVAL:
+                return self._window_bytes / elapsed
+            return self.measured
+
+
+class RateLimiter:
+    """Giới hạn băng thông upload/download của node: toàn cục, theo peer và theo torrent.
+
+    Every byte sent or received by a peer connection goes through delay(); the
+    caller waits for the slowest of the global, per-peer and (if set)
+    per-torrent buckets. Limits can be changed at runtime with the set_*
+    methods and current rates are reported by rates().
+    """
+
+    def __init__(self, upload_rate=None, download_rate=None, peer_upload_rate=None, peer_download_rate=None):
+        self.lock = threading.Lock()
+        self.global_buckets = {UPLOAD: TokenBucket(upload_rate), DOWNLOAD: TokenBucket(download_rate)}
+        self.peer_rates = {UPLOAD: peer_upload_rate, DOWNLOAD: peer_download_rate}
+        self.peer_buckets = {UPLOAD: {}, DOWNLOAD: {}}  # {direction: {peer: TokenBucket}}
+        self.torrent_buckets = {UPLOAD: {}, DOWNLOAD: {}}  # {direction: {magnet_link: TokenBucket}}
+
+    def delay(self, direction, nbytes, peer=None, torrent=None):
+        """Số giây cần chờ trước khi gửi/nhận nbytes"""
+        buckets = [self.global_buckets[direction]]
+        with self.lock:
+            if peer is not None:
+                bucket = self.peer_buckets[direction].get(peer)
+                if bucket is None:
+                    bucket = TokenBucket(self.peer_rates[direction])
+                    self.peer_buckets[direction][peer] = bucket
+                buckets.append(bucket)
+            if torrent is not None and torrent in self.torrent_buckets[direction]:
+                buckets.append(self.torrent_buckets[direction][torrent])
+        return max(bucket.reserve(nbytes) for bucket in buckets)
+
+    def set_global_rate(self, direction, rate):
+        self.global_buckets[direction].set_rate(rate)
+
+    def set_peer_rate(self, direction, rate):
+        """Đổi giới hạn mặc định cho mọi peer (cả peer đang kết nối)"""
+        with self.lock:
+            self.peer_rates[direction] = rate
+            buckets = list(self.peer_buckets[direction].values())
+        for bucket in buckets:
+            bucket.set_rate(rate)
+
+    def set_torrent_rate(self, direction, torrent, rate):
+        """Giới hạn riêng cho một torrent, rate=None để bỏ giới hạn"""
+        with self.lock:
+            if rate is None:
+                self.torrent_buckets[direction].pop(torrent, None)
+            elif torrent in self.torrent_buckets[direction]:
+                self.torrent_buckets[direction][torrent].set_rate(rate)
+            else:
+                self.torrent_buckets[direction][torrent] = TokenBucket(rate)
+
+    def forget_peer(self, peer):
+        with self.lock:
+            for buckets in self.peer_buckets.values():
+                buckets.pop(peer, None)
+
+    def rates(self):
+        """Tốc độ hiện tại (bytes/s) toàn cục, theo peer và theo torrent"""
+        with self.lock:
+            peers = {direction: dict(buckets) for direction, buckets in self.peer_buckets.items()}
+            torrents = {direction: dict(buckets) for direction, buckets in self.torrent_buckets.items()}
+        return {
+            direction: {
+                'total': self.global_buckets[direction].current_rate(),
+                'limit': self.global_buckets[direction].rate,
+                'peers': {peer: bucket.current_rate() for peer, bucket in peers[direction].items()},
+                'torrents': {torrent: bucket.current_rate() for torrent, bucket in torrents[direction].items()}
+            }
+            for direction in (UPLOAD, DOWNLOAD)
+        }
@@ -0,0 +1,76 @@
+import time, hashlib, logging, threading, concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+
+class ResumeVerifier(threading.Thread):
+    """Kiểm tra lại SHA-1 các piece mà bitfield đã lưu báo là có, chạy nền.
+
+    On restart the saved bitfield is trusted immediately so downloading can
+    resume at once; this thread then re-hashes those pieces from the download
+    file on a small worker pool, throttled to max_rate bytes/s so it does not
+    starve the download of disk bandwidth. A piece whose data does not match
+    (e.g. a torn write before a crash) is handed to on_failed() to be fetched
+    again. on_done() runs once every piece has been checked.
+    """
+
+    def __init__(self, storage, metadata, pieces, on_failed, on_done=None, workers=2, max_rate=None):
+        super().__init__()
+        self.daemon = True
+        self.storage = storage
+        self.metadata = metadata
+        self.pieces = list(pieces)
+        self.on_failed = on_failed
+        self.on_done = on_done
+        self.workers = workers
+        self.max_rate = max_rate  # bytes/s, None = không giới hạn
+        self.failed = []
+        self.finished = threading.Event()
+        self.stopped = threading.Event()
+        self._rate_lock = threading.Lock()
+        self._next_read = time.monotonic()
+
+    def run(self):
+        start = time.monotonic()
+        logger.info("Bắt đầu kiểm tra lại %s piece đã tải", len(self.pieces))
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for piece_index, ok in zip(self.pieces, pool.map(self._verify, self.pieces)):
+                    if ok is False:
+                        self.failed.append(piece_index)
+                        self.on_failed(piece_index)
+        except Exception as e:
+            logger.error("Lỗi khi kiểm tra lại piece: %s", e)
+        finally:
+            self.finished.set()
+        if self.stopped.is_set():
+            return
+        logger.info("Kiểm tra lại xong sau %.1fs, %s piece hỏng cần tải lại",
+                    time.monotonic() - start, len(self.failed))
+        if self.on_done:
+            self.on_done()
+
+    def _verify(self, piece_index):
+        """True/False theo kết quả so hash, None nếu đã dừng"""
+        if self.stopped.is_set():
+            return None
+        self._throttle(self.metadata.piece_size(piece_index))
+        data = self.storage.read_piece(piece_index)
+        return hashlib.sha1(data).digest() == self.metadata.piece_hashes[piece_index]
+
+    def _throttle(self, nbytes):
+        # Mỗi lần đọc đặt trước một khoảng thời gian tỉ lệ với số byte
+        if not self.max_rate:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            start = max(now, self._next_read)
+            self._next_read = start + nbytes / self.max_rate
+        if start > now:
+            self.stopped.wait(start - now)
+
+    def is_running(self):
+        return self.is_alive() and not self.finished.is_set()
+
+    def stop(self):
+        self.stopped.set()
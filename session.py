@@ -0,0 +1,401 @@
+import os, math, time, hashlib, logging, threading, collections
+from bitfield import Bitfield
+from storage import open_storage
+from peer_selector import PieceScheduler, PeerPool
+from resume import ResumeVerifier
+from config import block_size, max_peer_connections, min_peer_rate, slow_peer_grace
+from config import resume_verify_workers, resume_verify_rate, max_bad_blocks
+
+logger = logging.getLogger(__name__)
+
+# Sự kiện session gửi cho DownloadManager (xử lý trên thread của manager)
+PIECE_VERIFIED = "piece_verified"
+PIECE_FAILED = "piece_failed"
+BLOCK_FAILED = "block_failed"
+PEER_CONNECTED = "peer_connected"
+PEER_DROPPED = "peer_dropped"
+SOURCES_UPDATED = "sources_updated"
+RESUME_FAILED = "resume_failed"
+RESUME_VERIFIED = "resume_verified"
+
+
+class PieceBuffer:
+    """Ghép các block của một piece trước khi kiểm tra SHA-1"""
+
+    def __init__(self, piece_size, block_size=block_size):
+        self.data = bytearray(piece_size)
+        self.block_size = block_size
+        self.block_count = math.ceil(piece_size / block_size)
+        self.received = set()  # offset các block đã nhận
+        self.peers = set()  # Peer đã gửi block, để biết ai gửi piece hỏng
+
+    def add_block(self, offset, block_data, peer=None):
+        """Ghi block vào buffer, trả về True khi đã đủ tất cả block"""
+        if offset % self.block_size or offset + len(block_data) > len(self.data):
+            raise ValueError(f"Invalid block at offset {offset}")
+        if offset not in self.received:
+            self.data[offset:offset + len(block_data)] = block_data
+            self.received.add(offset)
+            if peer is not None:
+                self.peers.add(peer)
+        return len(self.received) == self.block_count
+
+
+class DownloadSession:
+    """Một torrent đang tải, với bitfield, file .part, scheduler và kết nối riêng.
+
+    All per-download state lives here instead of on Node, so one node can run
+    many downloads at once. Leecher connections hold their session and report
+    blocks/pieces to it; the seeding side finds the session through
+    Node.download_manager to serve pieces that are already verified.
+
+    Work that reacts to a change (a piece verified or failed, a peer gone,
+    new sources) is posted as an event and runs in the on_* handlers on the
+    DownloadManager thread, so connection threads only receive and hash.
+
+    Peers that send corrupt data collect strikes: one per block failing its
+    SHA-256 (torrents with block hashes), or per piece failing SHA-1 when a
+    single peer sent all of it. At max_bad_blocks the peer is banned from
+    this download and its pieces go to the other connections.
+    """
+
+    def __init__(self, node, magnet_link, metadata):
+        self.node = node
+        self.magnet_link = magnet_link
+        self.metadata = metadata
+        self.name = metadata.name
+        # File .part theo info-hash như bitfield: hai torrent trùng tên không ghi chung một file
+        self.part_path = os.path.join(node.downloads_dir, f"{metadata.info_hash}.part")
+        self.output_path = os.path.join(node.downloads_dir, metadata.name)  # Chọn lại khi đổi tên
+
+        # Chỉ tin bitfield đã lưu khi file .part tương ứng còn tồn tại
+        bitfield_path = os.path.join(node.resume_dir, f"{metadata.info_hash}.bitfield")
+        if os.path.exists(self.part_path):
+            self.bitfield = Bitfield.load(bitfield_path, metadata.piece_count)
+        else:
+            self.bitfield = Bitfield(metadata.piece_count, bitfield_path)
+
+        # Torrent nhiều file tải vào thư mục <info_hash>.part, đổi tên khi xong như file .part
+        self.storage = None  # FileStorage/MultiFileStorage của file .part, mở khi cần
+        self.storage_lock = threading.Lock()
+        self.piece_buffers = {}  # {piece_index: PieceBuffer} dùng chung cho mọi kết nối
+        self.piece_buffers_lock = threading.Lock()
+        # Torrent có block hash thì tách block theo cây Merkle của torrent
+        self.block_size = metadata.block_size if metadata.has_block_hashes else block_size
+        self.bad_blocks = collections.Counter()  # {peer: số block/piece hỏng đã gửi}
+        self.banned = set()
+        self.connections = []
+        self.scheduler = None
+        self.peer_pool = None
+        self.resume_verifier = None
+        self.finished = threading.Event()
+        self.finished_at = None  # time.monotonic() lúc tải xong
+        self.finish_lock = threading.Lock()
+        self.finishing = False  # finalize() đang chạy trên thread riêng
+        # Thời gian hash và ghi đĩa để phân biệt peer/node bị giới hạn bởi CPU, đĩa hay mạng
+        self.hash_seconds = node.metrics.histogram("p2p_piece_hash_seconds", "Thời gian kiểm tra SHA-1 một piece")
+        self.write_seconds = node.metrics.histogram("p2p_piece_write_seconds", "Thời gian ghi một piece vào đĩa")
+        self.pieces_counter = node.metrics.counter("p2p_pieces_total", "Piece đã tải và kiểm tra", ("result",))
+        self.blocks_failed = node.metrics.counter("p2p_blocks_failed_total", "Block sai hash SHA-256")
+        self.peers_banned = node.metrics.counter("p2p_peers_banned_total", "Peer bị cấm vì gửi dữ liệu hỏng")
+
+    def start(self, peers_data):
+        """Bắt đầu (hoặc tiếp tục) tải từ danh sách peer/piece của tracker"""
+        needed_pieces = self.bitfield.missing()
+        self.scheduler = PieceScheduler(
+            peers_data['pieces'],
+            needed_pieces,
+            exclude={(self.node.ip, int(self.node.port))}
+        )
+        self.peer_pool = PeerPool(
+            self,
+            max_connections=max_peer_connections,
+            min_rate=min_peer_rate,
+            grace=slow_peer_grace
+        )
+        self.peer_pool.start()
+        self.node.discovery.watch(
+            self.magnet_link,
+            lambda pieces_info: self.post(SOURCES_UPDATED, pieces_info=pieces_info)
+        )
+
+        # Tiếp tục download: tin bitfield đã lưu ngay, kiểm tra lại dữ liệu ở nền
+        if self.bitfield.count():
+            self.start_resume_verify()
+        else:
+            self.check_complete()
+
+    def post(self, event, **data):
+        self.node.download_manager.post(self, event, data)
+
+    def progress(self):
+        """(số piece đã có, tổng số piece)"""
+        return self.bitfield.count(), self.metadata.piece_count
+
+    def get_storage(self):
+        """File .part của download, cấp phát trước đủ kích thước"""
+        with self.storage_lock:
+            if self.storage is None:
+                self.storage = open_storage(self.part_path, self.metadata, writable=True)
+            return self.storage
+
+    def has_piece(self, piece_index):
+        return self.bitfield.has(piece_index)
+
+    def open_peer_connection(self, peer):
+        peer_conn = self.node.open_peer_connection(peer, self)
+        self.connections.append(peer_conn)
+        return peer_conn
+
+    def refill_connections(self):
+        """Cho các kết nối lấy thêm piece (sau khi piece được trả lại scheduler)"""
+        for peer_conn in list(self.connections):
+            if peer_conn.running:
+                peer_conn.fill_request_window()
+
+    def request_fresh_sources(self):
+        """Pool hết nguồn: nhờ PeerDiscovery làm mới sớm, không chặn"""
+        self.node.discovery.request_refresh()
+
+    def get_piece_size(self, piece_index):
+        return self.metadata.piece_size(piece_index)
+
+    def get_missing_blocks(self, piece_index):
+        """Danh sách (offset, length) các block của piece chưa nhận được"""
+        piece_size = self.get_piece_size(piece_index)
+        with self.piece_buffers_lock:
+            piece_buffer = self.piece_buffers.get(piece_index)
+            received = set(piece_buffer.received) if piece_buffer else set()
+        return [
+            (offset, min(self.block_size, piece_size - offset))
+            for offset in range(0, piece_size, self.block_size)
+            if offset not in received
+        ]
+
+    def handle_received_block(self, piece_index, offset, block_data, peer=None):
+        """Ghép block vào piece, kiểm tra và lưu piece khi đã đủ block.
+
+        Returns False when the block fails its hash and must be requested
+        again; the piece buffer is left untouched.
+        """
+        # Block đến muộn của piece đã xong (request trùng trong endgame)
+        if not self.scheduler.is_needed(piece_index):
+            return True
+        if not self.metadata.verify_block(piece_index, offset, block_data):
+            logger.warning("Block %s:%s của %s sai hash (peer %s)", piece_index, offset, self.name, peer)
+            self.blocks_failed.inc()
+            self.post(BLOCK_FAILED, peer=peer)
+            return False
+        with self.piece_buffers_lock:
+            piece_buffer = self.piece_buffers.get(piece_index)
+            if piece_buffer is None:
+                piece_buffer = PieceBuffer(self.get_piece_size(piece_index), self.block_size)
+                self.piece_buffers[piece_index] = piece_buffer
+            try:
+                complete = piece_buffer.add_block(offset, block_data, peer)
+            except ValueError as e:
+                logger.warning("Block không hợp lệ cho piece %s: %s", piece_index, e)
+                return True
+            if complete:
+                del self.piece_buffers[piece_index]
+
+        if complete:
+            self.handle_received_piece(piece_index, bytes(piece_buffer.data), piece_buffer.peers)
+        return True
+
+    def handle_received_piece(self, piece_index, piece_data, peers=()):
+        """Kiểm tra SHA-1, lưu piece và kiểm tra hoàn tất (peers: các peer đã gửi dữ liệu)"""
+        if not self.scheduler.is_needed(piece_index):
+            return
+        with self.hash_seconds.time():
+            valid = hashlib.sha1(piece_data).digest() == self.metadata.piece_hashes[piece_index]
+        if not valid:
+            logger.warning("Piece %s của %s không hợp lệ", piece_index, self.name)
+            self.pieces_counter.inc(result="failed")
+            self.post(PIECE_FAILED, piece_index=piece_index, peers=set(peers))
+            return
+        self.pieces_counter.inc(result="verified")
+
+        self.save_piece(piece_index, piece_data)
+        # Đánh dấu xong ngay để block trùng đến sau bị bỏ qua, phần còn lại do manager xử lý
+        peers = self.scheduler.piece_done(piece_index)
+        self.post(PIECE_VERIFIED, piece_index=piece_index, peers=peers)
+
+    def on_piece_verified(self, piece_index, peers):
+        self.node.announcer.queue(self.magnet_link, piece_index)
+        # Endgame: huỷ request trùng ở các peer khác
+        if len(peers) > 1:
+            for peer_conn in list(self.connections):
+                peer_conn.cancel_piece(piece_index)
+        self.check_complete()
+
+    def on_piece_failed(self, piece_index, peers):
+        # Chỉ quy lỗi cho peer khi cả piece do một peer gửi
+        if len(peers) == 1:
+            self.add_strike(next(iter(peers)))
+        # Trả piece về scheduler để tải lại từ peer khác
+        self.scheduler.piece_failed(piece_index, peers)
+        self.refill_connections()
+
+    def on_block_failed(self, peer):
+        # Kết nối đã trả piece cho scheduler (block đã nhận vẫn giữ), peer khác tải phần còn thiếu
+        self.add_strike(peer)
+        self.refill_connections()
+
+    def add_strike(self, peer):
+        """Tính một lần gửi dữ liệu hỏng cho peer, cấm peer khi đến max_bad_blocks"""
+        if peer is None or peer in self.banned:
+            return
+        self.bad_blocks[peer] += 1
+        if self.bad_blocks[peer] >= max_bad_blocks:
+            self.ban_peer(peer)
+
+    def ban_peer(self, peer):
+        """Không tải từ peer nữa trong download này và ngắt kết nối tới peer"""
+        logger.warning("Cấm peer %s:%s cho %s: đã gửi %s block/piece hỏng",
+                       peer[0], peer[1], self.name, self.bad_blocks[peer])
+        self.banned.add(peer)
+        self.peers_banned.inc()
+        self.scheduler.ban_peer(peer)
+        # Đóng kết nối sẽ trả piece dở của peer (PEER_DROPPED) cho các kết nối khác
+        for peer_conn in list(self.connections):
+            if peer_conn.peer_address == peer and peer_conn.running:
+                peer_conn.cleanup()
+
+    def on_peer_connected(self, peer):
+        logger.info("Đã kết nối peer %s:%s cho %s", peer[0], peer[1], self.name)
+
+    def on_peer_dropped(self, peer):
+        # Bỏ kết nối đã đóng, pool mở kết nối mới tới peer sau thời gian chờ
+        for peer_conn in list(self.connections):
+            if peer_conn.peer_address == peer and not peer_conn.running:
+                self.connections.remove(peer_conn)
+        # Trả piece dở của peer cho scheduler, các kết nối còn lại và pool tiếp quản ngay
+        if self.scheduler.release_peer(peer):
+            self.refill_connections()
+        self.peer_pool.fill()
+
+    def on_sources_updated(self, pieces_info):
+        self.peer_pool.update_sources(pieces_info)
+
+    def save_piece(self, piece_index, piece_data):
+        """Ghi piece đã kiểm tra vào đúng offset của file .part"""
+        storage = self.get_storage()
+        with self.write_seconds.time():
+            storage.write_piece(piece_index, piece_data)
+        self.bitfield.set(piece_index)
+        self.bitfield.save()
+        logger.debug("Đã lưu piece %s vào %s", piece_index, storage.path)
+
+    def start_resume_verify(self):
+        """Chạy ResumeVerifier cho các piece bitfield báo đã có"""
+        self.resume_verifier = ResumeVerifier(
+            self.get_storage(),
+            self.metadata,
+            [i for i in range(self.metadata.piece_count) if self.bitfield.has(i)],
+            on_failed=self._resume_piece_failed,
+            on_done=lambda: self.post(RESUME_VERIFIED),
+            workers=resume_verify_workers,
+            max_rate=resume_verify_rate
+        )
+        self.resume_verifier.start()
+
+    def _resume_piece_failed(self, piece_index):
+        """Chạy trên thread ResumeVerifier: xoá bit ngay, trước khi verifier báo xong.
+
+        check_complete() may run (for a PIECE_VERIFIED queued earlier) as soon
+        as the verifier finishes, so the bit must already be gone by then;
+        only the requeue waits for the RESUME_FAILED event.
+        """
+        self.bitfield.clear(piece_index)
+        self.bitfield.save(force=True)
+        self.post(RESUME_FAILED, piece_index=piece_index)
+
+    def on_resume_verified(self):
+        """Kiểm tra lại xong: thông báo các piece hợp lệ và kiểm tra hoàn tất"""
+        for piece_index in range(self.metadata.piece_count):
+            if self.bitfield.has(piece_index):
+                self.node.announcer.queue(self.magnet_link, piece_index)
+        self.check_complete()
+
+    def on_resume_failed(self, piece_index):
+        """Piece trong bitfield không khớp hash (bit đã được xoá): tải lại"""
+        logger.warning("Piece %s của %s hỏng sau khi khởi động lại, tải lại", piece_index, self.name)
+        self.scheduler.add_piece(piece_index)
+        self.peer_pool.fill()
+        self.refill_connections()
+
+    def check_complete(self):
+        """Hoàn tất download nếu đã đủ piece (chỉ chạy một lần)"""
+        # Chờ kiểm tra lại xong, piece hỏng có thể còn phải tải lại
+        if self.resume_verifier and self.resume_verifier.is_running():
+            return
+        if not self.bitfield.is_complete():
+            return
+        with self.finish_lock:
+            if self.finishing or self.finished.is_set():
+                return
+            self.finishing = True
+        # fsync và đổi tên chạy trên thread riêng, không chặn sự kiện của các download khác
+        thread = threading.Thread(target=self._finish)
+        thread.daemon = True
+        thread.start()
+
+    def _finish(self):
+        try:
+            self.finalize()
+        except Exception as e:
+            logger.error("Lỗi khi hoàn thành tải file %s: %s", self.name, e)
+            with self.finish_lock:
+                self.finishing = False
+            return
+        self.finished_at = time.monotonic()
+        self.finished.set()
+        logger.info("Đã tải xong file: %s", self.name)
+        self.stop()
+        self.node.download_manager.download_finished(self)
+
+    def finalize(self):
+        """Piece đã nằm đúng chỗ trong file .part, chỉ cần đổi tên và chuyển sang seed"""
+        storage = self.get_storage()
+        storage.sync()
+        # Đổi tên lần lượt từng download để không hai session nào chọn cùng một tên
+        with self.node.download_manager.rename_lock:
+            self.output_path = self._free_output_path()
+            storage.move_to(self.output_path)
+        logger.info("Đã hoàn tất file: %s", self.output_path)
+
+        # Storage giữ nguyên fd để tiếp tục seed trong lúc đổi tên
+        self.node.add_downloaded_file(self.magnet_link, self.metadata, storage)
+
+        # File đã đầy đủ, không cần dữ liệu resume nữa. Mọi piece đã được PieceAnnouncer
+        # thông báo cho tracker ngay khi kiểm tra xong (hoặc sau khi kiểm tra lại lúc resume)
+        self.bitfield.delete()
+
+    def _free_output_path(self):
+        """downloads/<name>, thêm " (n)" trước phần mở rộng nếu tên đã có file hoặc thư mục"""
+        base, ext = os.path.splitext(self.metadata.name)
+        path = os.path.join(self.node.downloads_dir, self.metadata.name)
+        n = 1
+        while os.path.lexists(path):
+            path = os.path.join(self.node.downloads_dir, f"{base} ({n}){ext}")
+            n += 1
+        return path
+
+    def stop(self):
+        """Dừng tải: ngắt kết nối, dừng pool/kiểm tra lại, lưu bitfield nếu chưa xong"""
+        self.node.discovery.unwatch(self.magnet_link)
+        if self.peer_pool:
+            self.peer_pool.stop()
+        if self.resume_verifier:
+            self.resume_verifier.stop()
+        for peer_conn in list(self.connections):
+            try:
+                peer_conn.cleanup()
+            except Exception as e:
+                logger.warning("Lỗi khi ngắt kết nối: %s", e)
+        self.connections = []
+        with self.piece_buffers_lock:
+            self.piece_buffers.clear()
+        if not self.finished.is_set():
+            self.bitfield.save(force=True)
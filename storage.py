@@ -0,0 +1,292 @@
+import os, bisect, threading, itertools, collections
+
+
+class FileRegion:
+    """A byte range of an open file, sent with os.sendfile when possible.
+
+    Used as the 'data' of PIECE_DATA / BLOCK_DATA so the binary protocol can
+    hand the range to the kernel instead of copying it through Python, and
+    so queued replies hold no data until they are sent. A storage without a
+    single fd (MultiFileStorage) is read into memory at send time instead.
+    """
+
+    def __init__(self, storage, offset, length):
+        self.storage = storage
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self):
+        return self.storage.read(self.offset, self.length)
+
+    def send_to(self, sock):
+        if not hasattr(os, 'sendfile') or not hasattr(self.storage, 'fd'):
+            sock.sendall(self.read())
+            return
+        offset, remaining = self.offset, self.length
+        while remaining > 0:
+            sent = os.sendfile(sock.fileno(), self.storage.fd, offset, remaining)
+            if sent == 0:
+                raise EOFError(f"Unexpected end of file {self.storage.path}")
+            offset += sent
+            remaining -= sent
+
+
+class FileStorage:
+    """Đọc/ghi piece trực tiếp trong một file theo offset, không cần thư mục piece_N.
+
+    Read-only storages serve a shared file. Writable storages back a download:
+    the file is preallocated to the torrent length and each verified piece is
+    written in place at its offset, so finishing a download is just a rename.
+    """
+
+    def __init__(self, path, piece_length, length, writable=False):
+        self.path = path
+        self.piece_length = piece_length
+        self.length = length
+        self.writable = writable
+        self.lock = threading.Lock()  # Chỉ dùng khi không có os.pread/os.pwrite (Windows)
+        if writable:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+            self._preallocate()
+        else:
+            size = os.path.getsize(path)
+            if size != length:
+                raise ValueError(f"{path} has {size} bytes, torrent expects {length}")
+            self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+
+    def _preallocate(self):
+        if os.fstat(self.fd).st_size != self.length:
+            os.ftruncate(self.fd, self.length)
+        # Đặt trước block trên đĩa nếu hệ thống hỗ trợ, nếu không thì để file sparse
+        if hasattr(os, 'posix_fallocate') and self.length > 0:
+            try:
+                os.posix_fallocate(self.fd, 0, self.length)
+            except OSError:
+                pass
+
+    def read(self, offset, length):
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, length, offset)
+        with self.lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, length)
+
+    def write(self, offset, data):
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+            return
+        with self.lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            while view:
+                view = view[os.write(self.fd, view):]
+
+    def write_piece(self, piece_index, data):
+        offset, length = self.piece_range(piece_index)
+        if len(data) != length:
+            raise ValueError(f"Piece {piece_index} has {len(data)} bytes, expected {length}")
+        self.write(offset, data)
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def piece_range(self, piece_index, offset=0, length=None):
+        """(offset trong file, độ dài) của piece hoặc block trong piece"""
+        piece_start = piece_index * self.piece_length
+        piece_size = min(self.piece_length, self.length - piece_start)
+        if piece_start < 0 or piece_size <= 0:
+            raise ValueError(f"Invalid piece index {piece_index}")
+        if length is None:
+            length = piece_size - offset
+        if offset < 0 or length <= 0 or offset + length > piece_size:
+            raise ValueError(f"Invalid range {offset}+{length} in piece {piece_index}")
+        return piece_start + offset, length
+
+    def read_piece(self, piece_index, offset=0, length=None):
+        return self.read(*self.piece_range(piece_index, offset, length))
+
+    def region(self, piece_index, offset=0, length=None):
+        return FileRegion(self, *self.piece_range(piece_index, offset, length))
+
+    def move_to(self, path):
+        """Đổi tên file (ví dụ .part -> tên cuối), giữ fd để các thread đang seed đọc tiếp"""
+        if os.name == 'nt':
+            # Windows không đổi tên được file đang mở: đóng và mở lại dưới lock, read() cũng
+            # dùng lock này vì không có os.pread (và không có sendfile)
+            with self.lock:
+                os.close(self.fd)
+                os.replace(self.path, path)
+                self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        else:
+            os.replace(self.path, path)
+        self.path = path
+        self.writable = False
+
+    def close(self):
+        os.close(self.fd)
+
+
+def list_files(root):
+    """Các file trong thư mục theo thứ tự cố định: [(list tên thư mục/file, độ dài)]"""
+    files = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        relative = os.path.relpath(dir_path, root)
+        components = [] if relative == os.curdir else relative.split(os.sep)
+        for file_name in sorted(file_names):
+            files.append((components + [file_name], os.path.getsize(os.path.join(dir_path, file_name))))
+    return files
+
+
+def _relative_path(components):
+    # Không cho đường dẫn trong torrent thoát ra ngoài thư mục tải
+    if not components or any(
+            not part or part in (os.curdir, os.pardir) or '/' in part or os.sep in part
+            for part in components):
+        raise ValueError(f"Invalid file path in torrent: {components}")
+    return os.path.join(*components)
+
+
+class MultiFileStorage(FileStorage):
+    """Torrent nhiều file: các piece nối liền qua ranh giới giữa các file.
+
+    path is the torrent's root directory. An offset in the torrent's byte
+    stream is mapped to (file, offset in file) by bisecting the file start
+    offsets, so the piece helpers of FileStorage work unchanged. Files are
+    opened on demand and at most MAX_OPEN_FILES stay open, so a dataset of
+    many small files does not run out of descriptors. A block can span
+    files, so its FileRegion is read into memory at send time instead of
+    going through sendfile.
+    """
+
+    MAX_OPEN_FILES = 64
+
+    def __init__(self, path, files, piece_length, writable=False):
+        self.path = path
+        self.files = [(_relative_path(components), length) for components, length in files]
+        self.starts = [0] + list(itertools.accumulate(length for _, length in self.files))[:-1]
+        self.piece_length = piece_length
+        self.length = sum(length for _, length in self.files)
+        self.writable = writable
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)  # Báo khi không còn file nào đang được đọc/ghi
+        self.open_files = collections.OrderedDict()  # {file index: FileStorage}, cũ nhất ở đầu
+        self.in_use = collections.Counter()  # Số thao tác đang đọc/ghi trên mỗi file mở
+        self.dirty = set()  # File đã ghi từ lần sync trước
+        if writable:
+            self._preallocate()
+
+    def _preallocate(self):
+        for relative_path, length in self.files:
+            file_path = os.path.join(self.path, relative_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if not os.path.exists(file_path) or os.path.getsize(file_path) != length:
+                FileStorage(file_path, length, length, writable=True).close()
+
+    def _acquire(self, index):
+        with self.lock:
+            storage = self.open_files.get(index)
+            if storage is None:
+                relative_path, length = self.files[index]
+                storage = FileStorage(os.path.join(self.path, relative_path), length, length, self.writable)
+                self.open_files[index] = storage
+            else:
+                self.open_files.move_to_end(index)
+            self.in_use[index] += 1
+            self._evict()
+            return storage
+
+    def _release(self, index):
+        with self.lock:
+            self.in_use[index] -= 1
+            if not self.in_use[index]:
+                del self.in_use[index]
+                if not self.in_use:
+                    self.idle.notify_all()
+            self._evict()
+
+    def _evict(self):
+        # Đóng các file ít dùng nhất, bỏ qua file đang được đọc/ghi
+        for index in list(self.open_files):
+            if len(self.open_files) <= self.MAX_OPEN_FILES:
+                break
+            if index not in self.in_use:
+                self.open_files.pop(index).close()
+
+    def _segments(self, offset, length):
+        """Các đoạn (file index, offset trong file, độ dài) của một khoảng byte"""
+        if offset < 0 or offset + length > self.length:
+            raise ValueError(f"Invalid range {offset}+{length} in {self.path}")
+        while length > 0:
+            index = bisect.bisect_right(self.starts, offset) - 1
+            file_offset = offset - self.starts[index]
+            size = min(length, self.files[index][1] - file_offset)
+            yield index, file_offset, size
+            offset += size
+            length -= size
+
+    def read(self, offset, length):
+        chunks = []
+        for index, file_offset, size in self._segments(offset, length):
+            storage = self._acquire(index)
+            try:
+                chunks.append(storage.read(file_offset, size))
+            finally:
+                self._release(index)
+        return b''.join(chunks)
+
+    def write(self, offset, data):
+        view = memoryview(data)
+        for index, file_offset, size in self._segments(offset, len(view)):
+            storage = self._acquire(index)
+            try:
+                storage.write(file_offset, view[:size])
+            finally:
+                self._release(index)
+            with self.lock:
+                self.dirty.add(index)
+            view = view[size:]
+
+    def sync(self):
+        # fsync qua fd mới vẫn ghi xuống đĩa dữ liệu đã ghi bằng fd đã đóng
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        for index in sorted(dirty):
+            storage = self._acquire(index)
+            try:
+                storage.sync()
+            finally:
+                self._release(index)
+
+    def move_to(self, path):
+        """Đổi tên thư mục gốc và chuyển sang chỉ đọc để tiếp tục seed"""
+        with self.lock:
+            if os.name == 'nt':
+                # Windows không đổi tên được thư mục có file đang mở: chờ các lần đọc dở
+                # rồi đóng hết, file được mở lại theo đường dẫn mới khi cần
+                self.idle.wait_for(lambda: not self.in_use)
+                for storage in self.open_files.values():
+                    storage.close()
+                self.open_files.clear()
+            os.replace(self.path, path)
+            self.path = path
+            self.writable = False
+
+    def close(self):
+        with self.lock:
+            for storage in self.open_files.values():
+                storage.close()
+            self.open_files.clear()
+
+
+def open_storage(path, metadata, writable=False):
+    """FileStorage hoặc MultiFileStorage tuỳ torrent một file hay nhiều file"""
+    if metadata.files:
+        return MultiFileStorage(path, metadata.files, metadata.piece_length, writable)
+    return FileStorage(path, metadata.piece_length, metadata.length, writable)
@@ -0,0 +1,83 @@
+import os, hashlib, bencodepy, pytest
+from hashing import MERKLE_HASH_LENGTH, hash_files, merkle_root, piece_roots
+from metadata import TorrentMetadata
+
+BLOCK_SIZE = 1024
+PIECE_LENGTH = 4 * BLOCK_SIZE
+# Piece cuối 1500 byte: một block đủ và một block ngắn
+LENGTH = 2 * PIECE_LENGTH + 1500
+
+
+@pytest.fixture
+def data():
+    return os.urandom(LENGTH)
+
+
+def _torrent(tmp_path, data):
+    path = tmp_path / "f.bin"
+    path.write_bytes(data)
+    pieces, block_hashes = hash_files([str(path)], PIECE_LENGTH, block_size=BLOCK_SIZE)
+    info = {
+        b'name': b'f.bin', b'piece length': PIECE_LENGTH, b'length': LENGTH, b'pieces': pieces,
+        b'block size': BLOCK_SIZE, b'piece roots': piece_roots(block_hashes, PIECE_LENGTH // BLOCK_SIZE)
+    }
+    return {b'info': info, b'piece layers': block_hashes}
+
+
+def _blocks(data, piece_index):
+    piece = data[piece_index * PIECE_LENGTH:(piece_index + 1) * PIECE_LENGTH]
+    return [(offset, piece[offset:offset + BLOCK_SIZE]) for offset in range(0, len(piece), BLOCK_SIZE)]
+
+
+def test_merkle_root_pads_to_power_of_two():
+    leaves = [hashlib.sha256(bytes([i])).digest() for i in range(3)]
+    zero = bytes(MERKLE_HASH_LENGTH)
+    left = hashlib.sha256(leaves[0] + leaves[1]).digest()
+    right = hashlib.sha256(leaves[2] + zero).digest()
+    assert merkle_root(leaves) == hashlib.sha256(left + right).digest()
+    assert merkle_root(leaves[:1]) == leaves[0]
+
+
+def test_every_block_verifies(tmp_path, data):
+    metadata = TorrentMetadata.from_torrent(_torrent(tmp_path, data))
+    assert metadata.has_block_hashes
+    assert [len(leaves) for leaves in metadata.block_hashes] == [4, 4, 2]
+    assert metadata.piece_size(2) == 1500
+    for piece_index in range(metadata.piece_count):
+        for offset, block in _blocks(data, piece_index):
+            assert metadata.verify_block(piece_index, offset, block)
+
+
+def test_corrupt_block_is_rejected(tmp_path, data):
+    metadata = TorrentMetadata.from_torrent(_torrent(tmp_path, data))
+    offset, block = _blocks(data, 1)[2]
+    corrupt = bytearray(block)
+    corrupt[100] ^= 0xff
+    assert not metadata.verify_block(1, offset, bytes(corrupt))
+    # Block đúng nhưng sai chỗ, sai độ dài hoặc lệch offset
+    assert not metadata.verify_block(0, offset, block)
+    assert not metadata.verify_block(1, offset + 1, block)
+    offset, block = _blocks(data, 2)[1]
+    assert not metadata.verify_block(2, offset, block + b'\0')
+    assert not metadata.verify_block(2, offset + BLOCK_SIZE, block)
+
+
+def test_piece_layers_must_match_roots(tmp_path, data):
+    torrent = _torrent(tmp_path, data)
+    layers = bytearray(torrent[b'piece layers'])
+    layers[5 * MERKLE_HASH_LENGTH] ^= 0xff
+    with pytest.raises(ValueError):
+        TorrentMetadata.from_torrent({b'info': torrent[b'info'], b'piece layers': bytes(layers)})
+    with pytest.raises(ValueError):
+        TorrentMetadata.from_torrent({b'info': torrent[b'info'],
+                                      b'piece layers': torrent[b'piece layers'] + bytes(MERKLE_HASH_LENGTH)})
+
+
+def test_block_hashes_survive_decoded_json(tmp_path, data):
+    torrent = _torrent(tmp_path, data)
+    metadata = TorrentMetadata.from_torrent(torrent)
+    decoded = TorrentMetadata.from_decoded_json(metadata.info_hash, metadata.to_decoded_json())
+    assert decoded.info_hash == hashlib.sha1(bencodepy.encode(torrent[b'info'])).hexdigest()
+    assert decoded.block_hashes == metadata.block_hashes
+    offset, block = _blocks(data, 2)[1]
+    assert decoded.verify_block(2, offset, block)
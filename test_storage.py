@@ -0,0 +1,76 @@
+import os, pytest
+from storage import FileStorage, MultiFileStorage
+
+# 15 byte qua 5 file, có file rỗng ở giữa và ở đầu thư mục con
+FILES = [(["a"], 5), (["empty"], 0), (["sub", "b"], 3), (["sub", "c"], 0), (["d"], 7)]
+PIECE_LENGTH = 4
+
+
+@pytest.fixture
+def data():
+    return os.urandom(sum(length for _, length in FILES))
+
+
+@pytest.fixture
+def storage(tmp_path, data):
+    storage = MultiFileStorage(str(tmp_path / "root"), FILES, PIECE_LENGTH, writable=True)
+    for piece_index in range(4):
+        storage.write_piece(piece_index, data[piece_index * PIECE_LENGTH:(piece_index + 1) * PIECE_LENGTH])
+    yield storage
+    storage.close()
+
+
+def test_segments_span_file_boundaries():
+    storage = MultiFileStorage("unused", FILES, PIECE_LENGTH)
+    # Bỏ qua file rỗng, không trả đoạn độ dài 0
+    assert list(storage._segments(3, 8)) == [(0, 3, 2), (2, 0, 3), (4, 0, 3)]
+    assert list(storage._segments(5, 1)) == [(2, 0, 1)]
+    assert list(storage._segments(8, 7)) == [(4, 0, 7)]
+    with pytest.raises(ValueError):
+        list(storage._segments(14, 2))
+
+
+def test_write_lands_in_each_file(tmp_path, storage, data):
+    storage.sync()
+    start = 0
+    for components, length in FILES:
+        with open(os.path.join(tmp_path, "root", *components), 'rb') as f:
+            assert f.read() == data[start:start + length]
+        start += length
+
+
+def test_read_across_files(storage, data):
+    assert storage.read(0, len(data)) == data
+    assert storage.read_piece(1) == data[4:8]
+    assert storage.read_piece(1, 1, 2) == data[5:7]
+    assert storage.region(2).read() == data[8:12]
+
+
+def test_last_piece_is_shorter(storage, data):
+    assert storage.piece_range(3) == (12, 3)
+    assert storage.read_piece(3) == data[12:]
+    with pytest.raises(ValueError):
+        storage.piece_range(4)
+    with pytest.raises(ValueError):
+        storage.piece_range(3, 2, 2)
+    with pytest.raises(ValueError):
+        storage.write_piece(3, bytes(PIECE_LENGTH))
+
+
+def test_open_files_are_bounded(storage, data):
+    storage.MAX_OPEN_FILES = 1
+    assert storage.read(0, len(data)) == data
+    assert len(storage.open_files) == 1
+
+
+def test_single_file_last_piece(tmp_path):
+    data = os.urandom(10)
+    path = str(tmp_path / "f.bin")
+    with open(path, 'wb') as f:
+        f.write(data)
+    storage = FileStorage(path, PIECE_LENGTH, len(data))
+    try:
+        assert storage.piece_range(2) == (8, 2)
+        assert storage.read_piece(2) == data[8:]
+    finally:
+        storage.close()
@@ -0,0 +1,72 @@
+import bencodepy, pytest
+from fake_tracker import FakeTracker
+from tracker_client import TrackerClient, piece_ranges
+
+MAGNET = "magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567&dn=test.bin"
+PEER = ("127.0.0.1", 52300)
+
+
+def _torrent(piece_count):
+    return bencodepy.encode({
+        b'info': {b'name': b'test.bin', b'piece length': 16384, b'length': 16384 * piece_count,
+                  b'pieces': bytes(20 * piece_count)}
+    })
+
+
+@pytest.fixture(params=[True, False], ids=["batch", "no-batch"])
+def tracker(request):
+    tracker = FakeTracker(batch=request.param).start()
+    tracker.add_file(MAGNET, "test.bin", _torrent(10), "127.0.0.1", 52299)
+    yield tracker
+    tracker.stop()
+
+
+def _sources(tracker, piece_index):
+    return {(node['ip'], node['port']) for node in tracker.peers(MAGNET)['pieces'][piece_index]['nodes']}
+
+
+def test_piece_ranges():
+    assert piece_ranges([5, 1, 2, 3, 9, 2]) == [[1, 3], [5, 5], [9, 9]]
+    assert piece_ranges([]) == []
+
+
+def test_announce_pieces(tracker):
+    client = TrackerClient(tracker.url)
+    assert client.announce_pieces(MAGNET, [0, 1, 2, 7], *PEER)
+    for piece_index in range(10):
+        assert (PEER in _sources(tracker, piece_index)) == (piece_index in (0, 1, 2, 7))
+    if tracker.batch:
+        # Hai đoạn [0, 2] và [7, 7] trong một request
+        assert client.batch_supported is True
+        assert tracker.requests == 1
+    else:
+        # Một lần thử batch bị 404, sau đó từng piece
+        assert client.batch_supported is False
+        assert tracker.requests == 1 + 4
+
+
+def test_fallback_is_remembered():
+    tracker = FakeTracker(batch=False).start()
+    try:
+        tracker.add_file(MAGNET, "test.bin", _torrent(10), "127.0.0.1", 52299)
+        client = TrackerClient(tracker.url)
+        assert client.announce_pieces(MAGNET, [0], *PEER)
+        requests_before = tracker.requests
+        assert client.announce_pieces(MAGNET, [3, 4], *PEER)
+        # Không thử lại /api/pieces/batch
+        assert tracker.requests - requests_before == 2
+        assert PEER in _sources(tracker, 4)
+    finally:
+        tracker.stop()
+
+
+def test_batches_split_by_batch_ranges():
+    tracker = FakeTracker().start()
+    try:
+        tracker.add_file(MAGNET, "test.bin", _torrent(10), "127.0.0.1", 52299)
+        client = TrackerClient(tracker.url, batch_ranges=2)
+        assert client.announce_pieces(MAGNET, [0, 2, 4, 6, 8], *PEER)
+        assert tracker.requests == 3
+        assert all(PEER in _sources(tracker, piece_index) for piece_index in (0, 2, 4, 6, 8))
+    finally:
+        tracker.stop()
@@ -0,0 +1,185 @@
+import time, threading, logging, collections, requests, concurrent.futures
+from requests.adapters import HTTPAdapter
+from config import tracker_host, tracker_timeout, tracker_pool_size, announce_batch_ranges, announce_interval
+
+logger = logging.getLogger(__name__)
+
+
+def piece_ranges(piece_indices):
+    """Gộp các piece index thành các đoạn liên tục [start, end] (bao gồm end)"""
+    ranges = []
+    for piece_index in sorted(set(piece_indices)):
+        if ranges and piece_index == ranges[-1][1] + 1:
+            ranges[-1][1] = piece_index
+        else:
+            ranges.append([piece_index, piece_index])
+    return ranges
+
+
+class TrackerClient:
+    """HTTP client dùng chung cho mọi request tới tracker.
+
+    All calls go through one requests.Session whose adapter keeps a pool of
+    keep-alive connections, so announcing thousands of pieces does not pay a
+    TCP/TLS handshake each time, and every call has a timeout. Piece
+    announcements are sent as ranges to /api/pieces/batch; if the tracker
+    does not have that endpoint, the client remembers it and falls back to
+    one PUT /api/pieces per piece, sent concurrently over the pool.
+    Request latency and errors per endpoint go to the node's metrics.
+    """
+
+    BATCH_UNSUPPORTED = (404, 405, 501)
+
+    def __init__(self, host=tracker_host, timeout=tracker_timeout, pool_size=tracker_pool_size,
+                 batch_ranges=announce_batch_ranges, metrics=None):
+        self.host = host.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.batch_ranges = batch_ranges
+        self.batch_supported = None  # None = chưa biết tracker có /api/pieces/batch không
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.request_seconds = None
+        if metrics:
+            self.request_seconds = metrics.histogram("p2p_tracker_request_seconds",
+                                                     "Thời gian một request tới tracker", ("endpoint",))
+            self.errors = metrics.counter("p2p_tracker_errors_total", "Request tới tracker bị lỗi", ("endpoint",))
+
+    def url(self, path):
+        return f"{self.host}{path}"
+
+    def _request(self, method, path, **kwargs):
+        if self.request_seconds is None:
+            return self.session.request(method, self.url(path), timeout=self.timeout, **kwargs)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.url(path), timeout=self.timeout, **kwargs)
+        except Exception:
+            self.errors.inc(endpoint=path)
+            raise
+        finally:
+            self.request_seconds.observe(time.perf_counter() - start, endpoint=path)
+        if response.status_code >= 400:
+            self.errors.inc(endpoint=path)
+        return response
+
+    def announce_node(self, ip, port):
+        return self._request('POST', "/api/nodes", json={"ip": ip, "port": port})
+
+    def share_file(self, torrent_file, magnet_link, name, ip, port):
+        data = {
+            'magnet_text': magnet_link,
+            'name': name,
+            'ip': ip,
+            'port': str(port)
+        }
+        return self._request('POST', "/api/files", files={'torrent_file': torrent_file}, data=data)
+
+    def get_peers(self, magnet_link):
+        return self._request('POST', "/api/files/peers", json={"magnet_text": magnet_link})
+
+    def announce_pieces(self, magnet_link, piece_indices, ip, port):
+        """Thông báo các piece node đang có, trả về True nếu tracker nhận hết"""
+        piece_indices = list(piece_indices)
+        if not piece_indices:
+            return True
+        if self.batch_supported is not False:
+            result = self._announce_batches(magnet_link, piece_ranges(piece_indices), ip, port)
+            if result is not None:
+                return result
+        return self._announce_each(magnet_link, piece_indices, ip, port)
+
+    def _announce_batches(self, magnet_link, ranges, ip, port):
+        """None nếu tracker không hỗ trợ batch (cần gửi từng piece)"""
+        ok = True
+        for start in range(0, len(ranges), self.batch_ranges):
+            data = {
+                "magnet_text": magnet_link,
+                "ranges": ranges[start:start + self.batch_ranges],
+                "ip": ip,
+                "port": str(port)
+            }
+            response = self._request('PUT', "/api/pieces/batch", json=data)
+            if response.status_code in self.BATCH_UNSUPPORTED and not self.batch_supported:
+                logger.info("Tracker không hỗ trợ thông báo batch, gửi từng piece")
+                self.batch_supported = False
+                return None
+            self.batch_supported = True
+            if response.status_code != 200:
+                logger.error("Lỗi khi thông báo batch piece cho tracker: %s", response.status_code)
+                ok = False
+        return ok
+
+    def _announce_each(self, magnet_link, piece_indices, ip, port):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.pool_size) as pool:
+            results = list(pool.map(
+                lambda piece_index: self._announce_piece(magnet_link, piece_index, ip, port),
+                piece_indices
+            ))
+        return all(results)
+
+    def _announce_piece(self, magnet_link, piece_index, ip, port):
+        data = {
+            "magnet_text": magnet_link,
+            "piece_index": str(piece_index),
+            "ip": ip,
+            "port": str(port)
+        }
+        try:
+            response = self._request('PUT', "/api/pieces", json=data)
+            if response.status_code != 200:
+                logger.error("Lỗi khi thông báo piece %s cho tracker: %s", piece_index, response.status_code)
+                return False
+            return True
+        except Exception as e:
+            logger.error("Lỗi khi gửi thông báo piece %s: %s", piece_index, e)
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+class PieceAnnouncer(threading.Thread):
+    """Gom các piece vừa kiểm tra xong và thông báo cho tracker theo batch.
+
+    handle_received_piece only queues the piece index; every interval the
+    pending pieces of each torrent are sent in one announce_pieces() call, so
+    a node becomes a source for what it has while its download is still
+    running. Pieces whose announcement fails are retried on the next flush.
+    """
+
+    def __init__(self, node, interval=announce_interval):
+        super().__init__()
+        self.daemon = True
+        self.node = node
+        self.interval = interval
+        self.pending = collections.defaultdict(set)  # {magnet_link: set(piece_index)}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def queue(self, magnet_link, piece_index):
+        with self.lock:
+            self.pending[magnet_link].add(piece_index)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, collections.defaultdict(set)
+        for magnet_link, pieces in pending.items():
+            try:
+                ok = self.node.tracker.announce_pieces(magnet_link, pieces, self.node.ip, self.node.port)
+            except Exception as e:
+                logger.error("Lỗi khi thông báo pieces cho tracker: %s", e)
+                ok = False
+            if not ok:
+                with self.lock:
+                    self.pending[magnet_link] |= pieces
+
+    def stop(self):
+        self.stopped.set()
+        self.flush()